@@ -4,8 +4,9 @@
 """
 import pyaudio
 import numpy as np
-import time
 import math
+import threading
+from collections import deque
 from typing import Generator, Optional
 import wave
 import os
@@ -16,7 +17,8 @@ class AudioInterface:
                  chunk: int = 1024, 
                  channels: int = 1,
                  energy_threshold: int = 1000,  # 能量阈值，根据麦克风调整
-                 silence_limit: float = 0.8):   # 静音多少秒后认为说话结束 (调小一点以加快响应，但不能太小)
+                 silence_limit: float = 0.8,    # 静音多少秒后认为说话结束 (调小一点以加快响应，但不能太小)
+                 max_speech_seconds: int = 30): # 单段语音最长录制时长，超出部分丢弃
         self.rate = rate
         self.chunk = chunk
         self.channels = channels
@@ -26,6 +28,36 @@ class AudioInterface:
         self.p = pyaudio.PyAudio()
         self.stream = None
         self._paused = False
+        # 预分配的录音缓冲区（16bit 采样），避免每段语音累积大量 bytes 对象再 join
+        self._speech_buf = bytearray(rate * channels * 2 * max_speech_seconds)
+        # 能量计算用的 int64 暂存区，每块复用，避免每次 astype 分配新数组；
+        # 采集回调线程使用独立的一块，与主线程的 _calculate_energy 互不干扰
+        self._energy_scratch = np.empty(chunk * channels, dtype=np.int64)
+        self._callback_scratch = np.empty(chunk * channels, dtype=np.int64)
+        # 回调线程采集到的 (音频块, 平方和)，由 listen_for_speech 消费；约保留5秒
+        # 暂停期间采集的块记为 (None, 0)，按采集时的状态而不是消费时的状态处理
+        self._chunks: deque = deque(maxlen=max(1, rate * 5 // chunk))
+        self._chunk_ready = threading.Event()
+
+    @property
+    def energy_threshold(self) -> int:
+        return self._energy_threshold
+
+    @energy_threshold.setter
+    def energy_threshold(self, value: int):
+        self._energy_threshold = value
+        # 预先换算为整块的平方和阈值，比较时无需开方（sqrt 单调）
+        self._threshold_ss = value * value * self.chunk * self.channels
+
+    @property
+    def silence_limit(self) -> float:
+        return self._silence_limit
+
+    @silence_limit.setter
+    def silence_limit(self, value: float):
+        self._silence_limit = value
+        # 静音按采集到的帧数计时（而非消费时的墙上时间），积压的数据一次处理时也不会误判
+        self._silence_limit_frames = int(value * self.rate)
 
     def pause(self):
         """暂停监听（但不关闭流，仅丢弃数据）"""
@@ -38,14 +70,27 @@ class AudioInterface:
     def start_stream(self):
         """启动音频流"""
         if self.stream is None:
+            self._chunks.clear()
+            self._chunk_ready.clear()
+            # 回调模式：PortAudio 在自己的线程中按块交付数据，不受主线程停顿影响
             self.stream = self.p.open(format=self.format,
                                       channels=self.channels,
                                       rate=self.rate,
                                       input=True,
-                                      frames_per_buffer=self.chunk)
+                                      frames_per_buffer=self.chunk,
+                                      stream_callback=self._on_audio)
         self._paused = False
         return self
 
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        """PortAudio 采集回调：计算能量后放入队列并唤醒监听循环"""
+        if self._paused:
+            self._chunks.append((None, 0))
+        else:
+            self._chunks.append((in_data, self._energy_ss(in_data, self._callback_scratch)))
+        self._chunk_ready.set()
+        return (None, pyaudio.paContinue)
+
     def stop_stream(self):
         """停止音频流"""
         if self.stream:
@@ -58,18 +103,24 @@ class AudioInterface:
         self.stop_stream()
         self.p.terminate()
 
+    def _energy_ss(self, data, scratch: np.ndarray) -> int:
+        """计算音频块的平方和（整数，用于与阈值比较），scratch 为调用线程专用的暂存区"""
+        # 将字节转换为numpy数组，提升到 int64 以免平方和溢出
+        audio_data = np.frombuffer(data, dtype=np.int16)
+        n = audio_data.size
+        if n <= scratch.size:
+            samples = scratch[:n]
+            np.copyto(samples, audio_data)
+        else:
+            samples = audio_data.astype(np.int64)
+        return int(np.dot(samples, samples))
+
     def _calculate_energy(self, data) -> float:
         """计算音频块的能量 (RMS)"""
-        # 将字节转换为numpy数组
-        audio_data = np.frombuffer(data, dtype=np.int16)
-        if len(audio_data) == 0:
+        n = len(data) // 2
+        if n == 0:
             return 0
-        # 计算RMS
-        mean_sq = np.mean(audio_data**2)
-        if mean_sq < 0 or np.isnan(mean_sq):
-            return 0
-        rms = np.sqrt(mean_sq)
-        return rms
+        return math.sqrt(self._energy_ss(data, self._energy_scratch) / n)
 
     def listen_for_speech(self) -> Generator[bytes, None, None]:
         """
@@ -82,61 +133,79 @@ class AudioInterface:
         """
         print(f"[*] 正在监听... (阈值: {self.energy_threshold})")
         
-        frames = []
-        silence_start = None
+        buf = memoryview(self._speech_buf)
+        capacity = len(buf)
+        write_pos = 0
+        frame_count = 0
+        silent_frames = 0
         is_speaking = False
+        bytes_per_frame = 2 * self.channels
+        
+        chunks = self._chunks
+        chunk_ready = self._chunk_ready
         
         while True:
             try:
-                data = self.stream.read(self.chunk, exception_on_overflow=False)
+                # 等待回调线程交付新数据（超时后重新等待，便于响应中断）
+                if not chunk_ready.wait(timeout=1.0):
+                    continue
+                chunk_ready.clear()
+            except KeyboardInterrupt:
+                break
+            
+            while chunks:
+                data, ss = chunks.popleft()
                 
-                # 如果处于暂停状态，直接丢弃数据并继续
-                if self._paused:
+                # 采集时处于暂停状态的块直接丢弃
+                if data is None:
                     # 如果之前正在说话，强制结束
                     if is_speaking:
                          is_speaking = False
-                         frames = []
-                         silence_start = None
+                         write_pos = 0
+                         frame_count = 0
+                         silent_frames = 0
                          print("[*] 系统发声中，中断当前录音")
                     continue
 
-                energy = self._calculate_energy(data)
+                is_loud = ss > self._threshold_ss
                 
                 if not is_speaking:
                     # 等待说话开始
-                    if energy > self.energy_threshold:
+                    if is_loud:
                         print("[!] 检测到语音，开始录制...")
                         is_speaking = True
-                        frames = [data] # 保留这一帧
-                        silence_start = None
+                        # 保留这一帧
+                        write_pos = len(data)
+                        buf[:write_pos] = data
+                        frame_count = 1
+                        silent_frames = 0
                     else:
                         # 可以在这里保存一点预缓冲，避免切掉开头的音
                         pass
                 else:
-                    # 正在录制
-                    frames.append(data)
+                    # 正在录制（缓冲区写满后丢弃后续数据，仍等待静音结束）
+                    end = write_pos + len(data)
+                    if end <= capacity:
+                        buf[write_pos:end] = data
+                        write_pos = end
+                        frame_count += 1
                     
-                    if energy > self.energy_threshold:
-                        silence_start = None # 重置静音计时
+                    if is_loud:
+                        silent_frames = 0 # 重置静音计时
                     else:
-                        if silence_start is None:
-                            silence_start = time.time()
-                        elif time.time() - silence_start > self.silence_limit:
+                        silent_frames += len(data) // bytes_per_frame
+                        if silent_frames > self._silence_limit_frames:
                             # 静音超时，认为说话结束
-                            print(f"[*] 语音结束，捕获 {len(frames)} 帧")
-                            full_audio = b''.join(frames)
+                            print(f"[*] 语音结束，捕获 {frame_count} 帧")
+                            full_audio = bytes(buf[:write_pos])
                             yield full_audio
                             
                             # 重置状态
-                            frames = []
+                            write_pos = 0
+                            frame_count = 0
                             is_speaking = False
-                            silence_start = None
+                            silent_frames = 0
                             print("[*] 继续监听...")
-            except IOError as e:
-                print(f"[!] 录音错误: {e}")
-                continue
-            except KeyboardInterrupt:
-                break
 
     def play_audio(self, file_path: str):
         """播放音频文件"""
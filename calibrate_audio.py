@@ -4,6 +4,7 @@
 """
 import pyaudio
 import numpy as np
+import math
 import time
 
 def calibrate():
@@ -11,6 +12,7 @@ def calibrate():
     FORMAT = pyaudio.paInt16
     CHANNELS = 1
     RATE = 16000
+    PRINT_INTERVAL = 0.25  # 刷新显示的最小间隔（秒），避免每块都写终端
     
     p = pyaudio.PyAudio()
     
@@ -28,6 +30,7 @@ def calibrate():
         
         max_energy = 0
         min_energy = 999999
+        last_print = 0.0
         
         while True:
             data = stream.read(CHUNK, exception_on_overflow=False)
@@ -35,23 +38,29 @@ def calibrate():
             
             # 计算能量 (RMS)
             # 防止空数据或全0导致的计算错误
-            if len(audio_data) == 0:
+            n = audio_data.size
+            if n == 0:
                 continue
-                
-            mean_sq = np.mean(audio_data**2)
-            if mean_sq < 0 or np.isnan(mean_sq):
-                energy = 0
-            else:
-                energy = int(np.sqrt(mean_sq))
             
-            max_energy = max(max_energy, energy)
-            min_energy = min(min_energy, energy)
+            samples = audio_data.astype(np.int64)
+            ss = int(np.dot(samples, samples))
+            energy = int(math.sqrt(ss / n))
+            
+            if energy > max_energy:
+                max_energy = energy
+            if energy < min_energy:
+                min_energy = energy
+            
+            now = time.monotonic()
+            if now - last_print < PRINT_INTERVAL:
+                continue
+            last_print = now
             
             # 简单的可视化条
-            bar_len = int(energy / 100)
+            bar_len = energy // 100
             bar = "#" * min(bar_len, 50)
             
-            print(f"\r当前能量: {energy:5d} | Min: {min_energy:5d} | Max: {max_energy:5d} | {bar}", end="")
+            print(f"\r当前能量: {energy:5d} | Min: {min_energy:5d} | Max: {max_energy:5d} | {bar}", end="", flush=True)
             
     except KeyboardInterrupt:
         print("\n\n" + "="*60)
@@ -2,6 +2,7 @@
 语境管理模块
 管理对话上下文和代词指代解析
 """
+import re
 from typing import List, Dict, Optional
 from conversation_manager import ConversationManager
 from device_state import DeviceState
@@ -10,6 +11,19 @@ from device_state import DeviceState
 class ContextManager:
     """管理对话语境和上下文"""
     
+    # 代词关键词（按长度降序，保证"刚才那个"优先于"刚才"/"那个"）
+    _PRONOUNS = ("刚才那个", "那个", "这个", "上面", "刚才", "之前", "它")
+    _PRONOUN_RE = re.compile("|".join(map(re.escape, _PRONOUNS)))
+    # 指代时间而非设备本身的代词，替换为"设备的xx"
+    _TEMPORAL_PRONOUNS = frozenset(("上面", "刚才", "之前"))
+    
+    _DEVICE_NAMES = {
+        "light": "灯",
+        "ac": "空调",
+        "window": "窗户",
+        "temperature": "温度"
+    }
+    
     def __init__(self, conversation_manager: ConversationManager, device_state: DeviceState):
         """
         初始化语境管理器
@@ -32,56 +46,28 @@ class ContextManager:
         Returns:
             替换后的文本（如"把灯关了"），如果无法解析返回None
         """
-        # 代词关键词
-        pronouns = ["它", "那个", "这个", "上面", "刚才", "之前", "刚才那个"]
-        
-        # 检查是否包含代词
-        contains_pronoun = any(pronoun in text for pronoun in pronouns)
-        
-        if not contains_pronoun:
+        # 一次扫描找到代词（较长的代词优先匹配）
+        match = self._PRONOUN_RE.search(text)
+        if not match:
             return None
+        pronoun = match.group(0)
         
         # 从对话历史中查找最近提到的设备
         last_device = self.conversation_manager.get_last_device_mentioned()
         if last_device:
-            device_names = {
-                "light": "灯",
-                "ac": "空调",
-                "window": "窗户",
-                "temperature": "温度"
-            }
-            device_name = device_names.get(last_device, last_device)
-            
-            # 替换代词
-            for pronoun in pronouns:
-                if pronoun in text:
-                    # 根据上下文替换
-                    if pronoun == "它":
-                        text = text.replace("它", device_name)
-                    elif pronoun in ["那个", "这个", "刚才那个"]:
-                        text = text.replace(pronoun, device_name)
-                    elif pronoun in ["上面", "刚才", "之前"]:
-                        text = text.replace(pronoun, f"{device_name}的{pronoun}")
-                    return text
+            device_name = self._DEVICE_NAMES.get(last_device, last_device)
+            # 根据上下文替换
+            if pronoun in self._TEMPORAL_PRONOUNS:
+                return text.replace(pronoun, f"{device_name}的{pronoun}")
+            return text.replace(pronoun, device_name)
         
         # 如果对话历史中没有，从设备状态中查找最近操作的设备
         recent_device = self.device_state.get_recently_operated_device()
         if recent_device:
-            device_names = {
-                "light": "灯",
-                "ac": "空调",
-                "window": "窗户",
-                "temperature": "温度"
-            }
-            device_name = device_names.get(recent_device, recent_device)
-            
-            for pronoun in pronouns:
-                if pronoun in text:
-                    if pronoun == "它":
-                        text = text.replace("它", device_name)
-                    elif pronoun in ["那个", "这个", "刚才那个"]:
-                        text = text.replace(pronoun, device_name)
-                    return text
+            if pronoun in self._TEMPORAL_PRONOUNS:
+                return text
+            device_name = self._DEVICE_NAMES.get(recent_device, recent_device)
+            return text.replace(pronoun, device_name)
         
         return None
     
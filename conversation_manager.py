@@ -5,6 +5,7 @@
 from datetime import datetime
 from typing import List, Dict, Optional
 from collections import deque
+import threading
 
 
 class ConversationManager:
@@ -19,6 +20,12 @@ class ConversationManager:
         """
         self.max_history = max_history
         self.conversation_history: deque = deque(maxlen=max_history)
+        # 与历史记录同步维护的指令列表（按时间顺序），避免每次查询都遍历历史
+        self._recent_commands: deque = deque()
+        # 拼接好的上下文字符串，历史变化时置空，下次读取时重建；
+        # 重建与置空都在锁内进行，避免并发时把基于旧历史拼出的字符串写回缓存
+        self._context_cache: Optional[str] = None
+        self._context_lock = threading.Lock()
     
     def add_message(self, role: str, content: str, command: Optional[Dict] = None):
         """
@@ -35,7 +42,34 @@ class ConversationManager:
             "timestamp": datetime.now().isoformat(),
             "command": command
         }
-        self.conversation_history.append(message)
+        # 预先生成上下文行，get_full_context 只需拼接
+        role_name = "用户" if role == "user" else "系统"
+        message["display_line"] = f"{role_name}：{content}"
+        
+        with self._context_lock:
+            history = self.conversation_history
+            if history.maxlen == 0:
+                # 不保留历史时，也不保留其中的指令
+                return
+            # 历史已满时，最旧的一条消息会被挤出，同步移除它携带的指令
+            if len(history) == history.maxlen:
+                evicted = history[0]
+                for _ in self._extract_commands(evicted):
+                    self._recent_commands.popleft()
+            
+            self.conversation_history.append(message)
+            self._recent_commands.extend(self._extract_commands(message))
+            self._context_cache = None
+    
+    @staticmethod
+    def _extract_commands(message: Dict) -> List[Dict]:
+        """提取消息携带的指令（兼容单指令和 {"commands": [...]} 两种格式）"""
+        cmd_data = message.get("command")
+        if not cmd_data:
+            return []
+        if isinstance(cmd_data, dict) and "commands" in cmd_data and isinstance(cmd_data["commands"], list):
+            return cmd_data["commands"]
+        return [cmd_data]
     
     def get_recent_history(self, n: int = 5) -> List[Dict]:
         """
@@ -56,15 +90,10 @@ class ConversationManager:
         Returns:
             格式化的对话历史字符串
         """
-        if not self.conversation_history:
-            return ""
-        
-        context_lines = []
-        for msg in self.conversation_history:
-            role_name = "用户" if msg["role"] == "user" else "系统"
-            context_lines.append(f"{role_name}：{msg['content']}")
-        
-        return "\n".join(context_lines)
+        with self._context_lock:
+            if self._context_cache is None:
+                self._context_cache = "\n".join(msg["display_line"] for msg in self.conversation_history)
+            return self._context_cache
     
     def get_recent_commands(self) -> List[Dict]:
         """
@@ -73,15 +102,7 @@ class ConversationManager:
         Returns:
             最近执行的指令列表
         """
-        commands = []
-        for msg in self.conversation_history:
-            if msg.get("command"):
-                cmd_data = msg["command"]
-                if isinstance(cmd_data, dict) and "commands" in cmd_data and isinstance(cmd_data["commands"], list):
-                    commands.extend(cmd_data["commands"])
-                else:
-                    commands.append(cmd_data)
-        return commands
+        return list(self._recent_commands)
     
     def get_last_device_mentioned(self) -> Optional[str]:
         """
@@ -90,17 +111,14 @@ class ConversationManager:
         Returns:
             设备类型（light/ac/window/temperature）或None
         """
-        # 从最近的对话中查找提到的设备
-        for msg in reversed(self.conversation_history):
-            if msg.get("command"):
-                cmd_data = msg["command"]
-                if isinstance(cmd_data, dict) and "commands" in cmd_data and isinstance(cmd_data["commands"], list):
-                    if cmd_data["commands"]:
-                        return cmd_data["commands"][-1].get("type")
-                else:
-                    return cmd_data.get("type")
+        # 最近一条指令即最近提到的设备
+        if self._recent_commands:
+            return self._recent_commands[-1].get("type")
         return None
     
     def clear_history(self):
         """清空对话历史"""
-        self.conversation_history.clear()
+        with self._context_lock:
+            self.conversation_history.clear()
+            self._recent_commands.clear()
+            self._context_cache = None
@@ -17,6 +17,10 @@ class DeviceState:
             "window": {"state": "closed", "last_action": None, "last_update": None},
             "temperature": {"last_check": None, "last_value": None}
         }
+        # 状态摘要缓存，仅在 update_state 修改状态后失效
+        self._summary_cache: Optional[str] = None
+        # 最近操作的设备，update_state 是唯一的修改入口，在其中维护
+        self._most_recent_device: Optional[str] = None
     
     def update_state(self, command: Dict):
         """
@@ -31,6 +35,7 @@ class DeviceState:
         if device_type not in self.devices:
             return
         
+        self._summary_cache = None
         current_time = datetime.now().isoformat()
         
         if device_type == "temperature":
@@ -51,6 +56,8 @@ class DeviceState:
             
             self.devices[device_type]["last_action"] = action
             self.devices[device_type]["last_update"] = current_time
+        
+        self._most_recent_device = device_type
     
     def get_state(self, device_type: str) -> Optional[Dict]:
         """
@@ -80,6 +87,9 @@ class DeviceState:
         Returns:
             格式化的状态摘要字符串
         """
+        if self._summary_cache is not None:
+            return self._summary_cache
+        
         summary_lines = []
         device_names = {
             "light": "灯",
@@ -105,7 +115,8 @@ class DeviceState:
                 last_action = info.get("last_action", "无")
                 summary_lines.append(f"{device_name}：{state_cn}（最后操作：{last_action}）")
         
-        return "\n".join(summary_lines) if summary_lines else "暂无设备状态信息"
+        self._summary_cache = "\n".join(summary_lines) if summary_lines else "暂无设备状态信息"
+        return self._summary_cache
     
     def get_recently_operated_device(self) -> Optional[str]:
         """
@@ -114,19 +125,4 @@ class DeviceState:
         Returns:
             设备类型或None
         """
-        most_recent = None
-        most_recent_time = None
-        
-        for device_type, info in self.devices.items():
-            if device_type == "temperature":
-                check_time = info.get("last_check")
-                if check_time and (most_recent_time is None or check_time > most_recent_time):
-                    most_recent_time = check_time
-                    most_recent = device_type
-            else:
-                update_time = info.get("last_update")
-                if update_time and (most_recent_time is None or update_time > most_recent_time):
-                    most_recent_time = update_time
-                    most_recent = device_type
-        
-        return most_recent
+        return self._most_recent_device
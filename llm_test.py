@@ -1,15 +1,27 @@
 import requests
+from requests.adapters import HTTPAdapter
+
+# 复用同一个连接（keep-alive），避免每次请求重新建立TCP连接
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
 
 url = "http://127.0.0.1:11434/api/generate"
 data = {
     "model": "qwen2.5:7b",
     "prompt": "解释什么是无需唤醒词语音系统",
-    "stream": True  # 流式输出
+    "stream": True,  # 流式输出
+    "options": {"num_ctx": 2048}  # 限制上下文长度，控制KV缓存大小
 }
 
-resp = requests.post(url, json=data, stream=True)
+resp = SESSION.post(url, json=data, stream=True)
 
-# 逐行读取输出
-for line in resp.iter_lines():
-    if line:
-        print(line.decode("utf-8"))
+# 按块读取输出，按换行切分出每条JSON
+buf = b""
+for chunk in resp.iter_content(chunk_size=4096):
+    buf += chunk
+    while b"\n" in buf:
+        line, _, buf = buf.partition(b"\n")
+        if line:
+            print(line.decode("utf-8"))
+if buf:
+    print(buf.decode("utf-8"))
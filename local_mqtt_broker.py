@@ -5,29 +5,109 @@
 import threading
 import queue
 import json
+import logging
 import os
 import time
 from datetime import datetime
 from typing import Dict, List, Optional
 
+# 优先使用 orjson 序列化/解析消息（C实现，直接输出UTF-8字节），不可用时退回标准库
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    _loads = json.loads
+
+log = logging.getLogger(__name__)
+
+# Linux 下使用 inotify 等待文件写入，其他平台退回轮询
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+    INOTIFY_AVAILABLE = True
+except ImportError:
+    INOTIFY_AVAILABLE = False
+
+
+def _default_message_file() -> str:
+    """
+    默认消息文件路径
+    
+    优先使用环境变量 MQTT_MESSAGE_FILE；Linux 下放在 /dev/shm（内存文件系统），
+    读写只经过页缓存，不落盘；其他平台使用当前目录下的 .mqtt_messages.jsonl
+    """
+    path = os.getenv('MQTT_MESSAGE_FILE')
+    if path:
+        return path
+    if os.path.isdir('/dev/shm'):
+        return f"/dev/shm/smart_home_mqtt_{os.getuid()}.jsonl"
+    return ".mqtt_messages.jsonl"
+
 
 class LocalMQTTBroker:
     """本地MQTT Broker模拟器 - 使用文件进行进程间通信"""
     
-    def __init__(self, message_file: str = ".mqtt_messages.jsonl"):
-        """初始化broker"""
-        self.message_file = message_file
+    # 消息文件超过该大小（字节）后轮转：删除旧文件并新建，避免在内存文件系统中无限增长
+    MAX_FILE_SIZE = 1 << 20
+    
+    def __init__(self, message_file: Optional[str] = None, persist: Optional[bool] = None):
+        """
+        初始化broker
+        
+        Args:
+            message_file: 消息文件路径，默认见 _default_message_file
+            persist: 是否写入消息文件（跨进程通信）；为False时只投递给本进程内的订阅者。
+                     默认读取环境变量 MQTT_BROKER_PERSIST（默认 true）
+        """
+        self.message_file = message_file or _default_message_file()
+        if persist is None:
+            persist = os.getenv('MQTT_BROKER_PERSIST', 'true').lower() == 'true'
+        self.persist = persist
         self.subscriptions = {}  # topic -> [callback_queue]
         self.running = False
         self._lock = threading.Lock()
+        # 保护写描述符的检查、重新打开与写入（多个线程可能同时发布）
+        self._writer_lock = threading.Lock()
         
-        # 确保消息文件存在
-        if not os.path.exists(self.message_file):
-            with open(self.message_file, 'w', encoding='utf-8') as f:
-                pass  # 创建空文件
+        # 以追加模式打开一次消息文件（不存在则创建），发布时直接写入
+        self._writer_fd = self._open_writer() if persist else None
         
         print("本地MQTT Broker已初始化")
     
+    def _open_writer(self) -> int:
+        """打开消息文件的追加写描述符"""
+        return os.open(self.message_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    
+    def _reopen_writer(self):
+        """关闭并重新打开写描述符（调用方需持有 _writer_lock）；打开失败时置为None，下次发布再重试"""
+        os.close(self._writer_fd)
+        self._writer_fd = None
+        self._writer_fd = self._open_writer()
+    
+    def _rotate(self, ino: int):
+        """删除当前消息文件并新建（其他进程已先轮转时不再删除新文件；调用方需持有 _writer_lock）"""
+        try:
+            if os.stat(self.message_file).st_ino == ino:
+                os.unlink(self.message_file)
+        except FileNotFoundError:
+            pass
+        self._reopen_writer()
+    
+    def close(self):
+        """关闭消息文件"""
+        with self._writer_lock:
+            if self._writer_fd is not None:
+                os.close(self._writer_fd)
+                self._writer_fd = None
+    
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+    
     def subscribe(self, topic: str, callback_queue: queue.Queue):
         """订阅主题"""
         with self._lock:
@@ -39,87 +119,147 @@ class LocalMQTTBroker:
     
     def publish(self, topic: str, payload: str):
         """发布消息到文件（跨进程通信）"""
-        message = {
-            'topic': topic,
-            'payload': payload,
-            'timestamp': datetime.now().isoformat()
-        }
+        return self.publish_batch(topic, [payload])
+    
+    def publish_batch(self, topic: str, payloads: List[str]):
+        """批量发布同一主题的多条消息：一次写入文件，共用同一时间戳"""
+        if not payloads:
+            return True
+        timestamp = datetime.now().isoformat()
+        messages = [{'topic': topic, 'payload': payload, 'timestamp': timestamp} for payload in payloads]
         
-        # 写入文件（追加模式）
-        try:
-            with open(self.message_file, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(message, ensure_ascii=False) + '\n')
-                f.flush()  # 立即刷新到磁盘
-        except Exception as e:
-            print(f"⚠ 写入消息文件失败: {e}")
-            return False
+        # 写入文件：O_APPEND 下单次 write 是原子追加，无需 flush；
+        # 但检查、重新打开描述符与写入需在锁内完成，避免其他线程写入已关闭的描述符
+        if self.persist:
+            data = b''.join(_dumps(message) + b'\n' for message in messages)
+            with self._writer_lock:
+                try:
+                    if self._writer_fd is None:
+                        # 上次重新打开失败，重试
+                        self._writer_fd = self._open_writer()
+                    st = os.fstat(self._writer_fd)
+                    if st.st_nlink == 0:
+                        # 消息文件被删除（链接数为0）时重新创建，否则订阅者读不到
+                        self._reopen_writer()
+                    elif st.st_size >= self.MAX_FILE_SIZE:
+                        # 轮转：订阅者读完旧文件剩余内容后，按 inode 变化切换到新文件
+                        self._rotate(st.st_ino)
+                    os.write(self._writer_fd, data)
+                except Exception as e:
+                    log.warning("⚠ 写入消息文件失败: %s", e)
+                    return False
         
         # 同时尝试通知本进程内的订阅者（如果存在）
         with self._lock:
             if topic in self.subscriptions:
                 for callback_queue in self.subscriptions[topic]:
-                    try:
-                        callback_queue.put_nowait(message)
-                    except queue.Full:
-                        pass
+                    for message in messages:
+                        try:
+                            callback_queue.put_nowait(message)
+                        except queue.Full:
+                            pass
         
-        print(f"✓ 消息已发布到主题: {topic}")
+        log.debug("✓ %d 条消息已发布到主题: %s", len(messages), topic)
         return True
     
     def read_messages(self, callback_queue: queue.Queue, topics: List[str]):
-        """从文件读取消息并放入队列（用于订阅者）"""
+        """从文件读取消息并放入队列（用于订阅者）；不写消息文件时无需读取，直接返回"""
+        if not self.persist:
+            return
+        
+        # 新订阅者从文件末尾开始读取，不重放启动前的历史消息
+        fd = None
         last_position = 0
+        try:
+            fd = os.open(self.message_file, os.O_RDONLY)
+            last_position = os.fstat(fd).st_size
+        except FileNotFoundError:
+            pass
+        
+        # 监视消息文件所在目录（按文件名过滤）：文件尚未创建、或被删除后重建时仍能收到通知
+        inotify = None
+        watch_name = os.path.basename(self.message_file)
+        if INOTIFY_AVAILABLE:
+            try:
+                inotify = INotify()
+                inotify.add_watch(os.path.dirname(os.path.abspath(self.message_file)),
+                                  inotify_flags.MODIFY | inotify_flags.CREATE | inotify_flags.MOVED_TO)
+            except OSError:
+                inotify = None
         
         while self.running:
             try:
-                # 检查文件是否有新内容
-                if os.path.exists(self.message_file):
-                    file_size = os.path.getsize(self.message_file)
+                # 复用同一个只读文件描述符；文件被删除、替换或轮转时，读完旧文件后重新打开
+                try:
+                    file_ino = os.stat(self.message_file).st_ino
+                except FileNotFoundError:
+                    file_ino = None
+                if fd is None and file_ino is not None:
+                    fd = os.open(self.message_file, os.O_RDONLY)
+                    last_position = 0
+                
+                if fd is not None:
+                    file_size = os.fstat(fd).st_size
                     
                     # 如果文件大小小于上次位置，说明文件被重置了
                     if file_size < last_position:
                         last_position = 0
                     
-                    # 如果有新内容
+                    # 如果有新内容，一次性读出
                     if file_size > last_position:
-                        with open(self.message_file, 'r', encoding='utf-8') as f:
-                            # 移动到上次读取的位置
-                            f.seek(last_position)
-                            
-                            # 读取新行
-                            new_lines = []
-                            for line in f:
-                                if line.strip():
-                                    new_lines.append(line.strip())
-                            
-                            # 处理新行
-                            for line in new_lines:
+                        os.lseek(fd, last_position, os.SEEK_SET)
+                        blob = os.read(fd, file_size - last_position)
+                        
+                        # 只处理完整的行，未写完的行留到下次读取
+                        end = blob.rfind(b'\n') + 1
+                        last_position += end
+                        
+                        for line in blob[:end].splitlines():
+                            if not line.strip():
+                                continue
+                            try:
+                                message = _loads(line)
+                            except ValueError:
+                                continue
+                            # 检查主题是否匹配
+                            if message.get('topic') in topics:
                                 try:
-                                    message = json.loads(line)
-                                    # 检查主题是否匹配
-                                    if message.get('topic') in topics:
-                                        try:
-                                            callback_queue.put_nowait(message)
-                                        except queue.Full:
-                                            # 队列满，尝试清空旧消息
-                                            try:
-                                                while not callback_queue.empty():
-                                                    callback_queue.get_nowait()
-                                                callback_queue.put_nowait(message)
-                                            except:
-                                                pass
-                                except json.JSONDecodeError:
-                                    pass
-                            
-                            # 更新位置
-                            last_position = f.tell()
+                                    callback_queue.put_nowait(message)
+                                except queue.Full:
+                                    # 队列满，尝试清空旧消息
+                                    try:
+                                        while not callback_queue.empty():
+                                            callback_queue.get_nowait()
+                                        callback_queue.put_nowait(message)
+                                    except:
+                                        pass
+                    
+                    # 旧文件已读完且路径已指向新文件（或被删除）：关闭旧描述符，立即读取新文件
+                    if os.fstat(fd).st_ino != file_ino:
+                        os.close(fd)
+                        fd = None
+                        last_position = 0
+                        if file_ino is not None:
+                            continue
                 
-                # 短暂休眠，避免CPU占用过高
-                time.sleep(0.2)
+                if inotify is not None:
+                    # 阻塞等待消息文件被写入或创建（超时后重新检查 running 状态），忽略目录中其他文件的事件
+                    while self.running:
+                        events = inotify.read(timeout=1000)
+                        if not events or any(event.name == watch_name for event in events):
+                            break
+                else:
+                    # 短暂休眠，避免CPU占用过高
+                    time.sleep(0.2)
                 
             except Exception as e:
-                print(f"⚠ 读取消息文件失败: {e}")
+                log.warning("⚠ 读取消息文件失败: %s", e)
                 time.sleep(0.5)
+        
+        if fd is not None:
+            os.close(fd)
+        if inotify is not None:
+            inotify.close()
 
 
 # 全局broker实例（每个进程一个）
@@ -1,13 +1,20 @@
 """
 智能家居指令识别测试程序主入口
 """
+import os
 import sys
+import logging
 from model_handler import ModelHandler
 from mqtt_client import MQTTClient
 from conversation_manager import ConversationManager
 from device_state import DeviceState
 from context_manager import ContextManager
 
+# 退出和确认关键词（集合查找）
+EXIT_WORDS = frozenset({'quit', 'exit', '退出'})
+CONFIRM_YES = frozenset({'y', 'yes', '是', '确认'})
+CONFIRM_NO = frozenset({'n', 'no', '否', '取消'})
+
 
 def main():
     """主程序入口"""
@@ -30,14 +37,12 @@ def main():
     # 初始化模型处理器（默认使用qwen2.5:7b，可根据实际情况修改）
     model_handler = ModelHandler(model_name="qwen2.5:7b")
     
-    # 预热模型（首次调用可能需要加载时间）
+    # 预加载模型（首次加载可能需要一些时间），之后每20分钟刷新一次，避免空闲时被Ollama卸载
     print("正在预热模型（首次加载可能需要一些时间）...")
-    try:
-        # 发送一个简单的测试请求来预热模型
-        test_result = model_handler.recognize_command("测试")
+    if model_handler.warmup(refresh_interval=20 * 60):
         print("✓ 模型已准备就绪\n")
-    except Exception as e:
-        print(f"⚠ 模型预热失败，但可以继续使用: {e}\n")
+    else:
+        print("⚠ 模型预热失败，但可以继续使用\n")
     
     # 初始化MQTT客户端
     mqtt_client = MQTTClient()
@@ -56,7 +61,7 @@ def main():
             user_input = input("请输入指令: ").strip()
             
             # 检查退出命令
-            if user_input.lower() in ['quit', 'exit', '退出']:
+            if user_input.lower() in EXIT_WORDS:
                 print("\n程序退出")
                 break
             
@@ -83,37 +88,40 @@ def main():
             result = model_handler.recognize_command(resolved_input, conversation_history, device_states)
             
             # 检查是否有明确指令
-            if result.get('type') != 'none':
+            commands = result.get('commands') or []
+            if commands:
                 # 有明确指令，直接询问确认
-                formatted_msg = model_handler.format_command_message(result)
-                print(f"\n识别到指令: {formatted_msg}")
-                print(f"详细信息: {result}")
+                formatted_msgs = [model_handler.format_command_message(cmd) for cmd in commands]
+                print(f"\n识别到指令: {', '.join(formatted_msgs)}")
+                print(f"详细信息: {commands}")
                 
                 # 设置待确认指令
-                context_manager.set_pending_confirmation(result)
+                context_manager.set_pending_confirmation(commands[0])
                 
                 # 询问用户确认
                 while True:
                     confirm = input("\n是否执行此指令？(y/n): ").strip().lower()
-                    if confirm in ['y', 'yes', '是', '确认']:
+                    if confirm in CONFIRM_YES:
                         # 发送MQTT消息
                         if mqtt_available:
-                            success = mqtt_client.send_command(result)
-                            if success:
-                                # 更新设备状态
-                                device_state.update_state(result)
-                                # 添加系统响应到对话历史
-                                response_text = f"已执行指令: {formatted_msg}"
-                                conversation_manager.add_message("assistant", response_text, result)
-                                print("✓ 指令已发送\n")
-                            else:
-                                print("✗ 指令发送失败\n")
+                            results = mqtt_client.send_commands(commands)
+                            for cmd, formatted_msg, success in zip(commands, formatted_msgs, results):
+                                if success:
+                                    # 更新设备状态
+                                    device_state.update_state(cmd)
+                                    # 添加系统响应到对话历史
+                                    response_text = f"已执行指令: {formatted_msg}"
+                                    conversation_manager.add_message("assistant", response_text, cmd)
+                                    print(f"✓ 指令已发送: {formatted_msg}")
+                                else:
+                                    print(f"✗ 指令发送失败: {formatted_msg}")
+                            print()
                         else:
                             print("⚠ MQTT不可用，无法发送指令\n")
                         # 清除待确认指令
                         context_manager.set_pending_confirmation(None)
                         break
-                    elif confirm in ['n', 'no', '否', '取消']:
+                    elif confirm in CONFIRM_NO:
                         print("已取消执行\n")
                         # 清除待确认指令
                         context_manager.set_pending_confirmation(None)
@@ -126,16 +134,24 @@ def main():
                 # 有潜在指令，LLM主动询问用户
                 potential_commands = result.get('potential', [])
                 
-                # 生成询问文本
                 print(f"\n💡 检测到潜在意图")
-                question = model_handler.generate_question(user_input, potential_commands)
-                print(f"{question}")
-                
-                # 添加系统询问到对话历史
-                conversation_manager.add_message("assistant", question)
                 
-                # 等待用户自然语言回答
-                user_response = input("您的回答: ").strip()
+                suggestions = [cmd.get('suggestion', '') for cmd in potential_commands]
+                if all(suggestions):
+                    # 识别结果已带有建议文本：直接展示建议并记入历史，无需再生成询问
+                    for suggestion in suggestions:
+                        print(suggestion)
+                    conversation_manager.add_message("assistant", "\n".join(suggestions))
+                    user_response = input("您的回答: ").strip()
+                else:
+                    question = model_handler.generate_question(user_input, potential_commands)
+                    print(f"{question}")
+                    
+                    # 添加系统询问到对话历史
+                    conversation_manager.add_message("assistant", question)
+                    
+                    # 等待用户自然语言回答
+                    user_response = input("您的回答: ").strip()
                 
                 if not user_response:
                     print("已取消\n")
@@ -154,9 +170,15 @@ def main():
                 # 获取更新的对话历史
                 conversation_history = conversation_manager.get_full_context()
                 
-                # 解析用户回答，识别要执行的指令（带上下文）
-                print(f"\n正在解析您的回答...")
-                selected_commands = model_handler.parse_user_response(resolved_response, potential_commands, conversation_history)
+                # 是/否/序号等简单回答直接按规则处理，无需调用模型
+                handled, selected_commands = model_handler.try_direct_pick(resolved_response, potential_commands)
+                if handled and selected_commands is None:
+                    print("已取消\n")
+                    continue
+                if not handled:
+                    # 解析用户回答，识别要执行的指令（带上下文）
+                    print(f"\n正在解析您的回答...")
+                    selected_commands = model_handler.parse_user_response(resolved_response, potential_commands, conversation_history)
                 
                 if selected_commands is None:
                     print("⚠ 无法识别您的意图")
@@ -176,12 +198,13 @@ def main():
                         formatted_msg = model_handler.format_command_message(cmd)
                         print(f"   - {formatted_msg}")
                     
-                    # 依次发送所有指令
+                    # 批量发送所有指令
                     if mqtt_available:
                         success_count = 0
                         response_texts = []
-                        for cmd in selected_commands:
-                            if mqtt_client.send_command(cmd):
+                        results = mqtt_client.send_commands(selected_commands)
+                        for cmd, ok in zip(selected_commands, results):
+                            if ok:
                                 # 更新设备状态
                                 device_state.update_state(cmd)
                                 success_count += 1
@@ -236,4 +259,5 @@ def main():
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format="%(message)s")
     main()
@@ -3,42 +3,91 @@
 使用Ollama API识别智能家居指令
 """
 import json
+import re
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import sys
 import time
-from typing import Optional, Dict
+from collections import OrderedDict
+from typing import Callable, Optional, Dict, Tuple, Union
 
+# 优先使用 orjson 序列化请求体/解析响应（C实现，直接处理UTF-8字节），不可用时退回标准库
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    _loads = json.loads
 
-class ModelHandler:
-    """处理Ollama模型调用和指令识别"""
-    
-    def __init__(self, model_name: str = "qwen2.5:7b", base_url: str = "http://127.0.0.1:11434"):
-        """
-        初始化模型处理器
-        
-        Args:
-            model_name: Ollama模型名称，默认为qwen2.5:7b
-            base_url: Ollama服务地址，默认为http://127.0.0.1:11434
-        """
-        self.model_name = model_name
-        self.base_url = base_url
-        self.api_url = f"{base_url}/api/generate"
-    
-    def analyze_intent(self, user_input: str, conversation_history: str = "") -> Dict:
-        """
-        分析用户意图：指令、闲聊还是忽略
-        """
-        prompt = f"""你是一个智能语音助手。请分析用户的语音转文字内容，判断其意图。
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# 简单明确的指令直接由正则识别，不调用模型
+# 输入需整句匹配（去除标点后），含否定、疑问或其他内容的句子仍交给模型处理
+_FAST_PUNCT_RE = re.compile(r"[\s，。！？!?,.、~～]+")
+_FAST_ON = r"(?:打开|开启|开开|开)"
+_FAST_OFF = r"(?:关闭|关掉|关上|关)"
+# 各设备的常见叫法
+_FAST_DEVICES = (
+    ("light", "灯", r"(?:电灯|灯光|大灯|台灯|灯)"),
+    ("ac", "空调", r"(?:空调|冷气)"),
+    ("window", "窗户", r"(?:窗户|窗子|窗)"),
+)
+
+
+def _build_fast_path():
+    """构建快速匹配正则（每种指令一个命名分组，一次扫描完成匹配）及对应的指令模板"""
+    branches = []
+    templates = {}
+    for cmd_type, device, device_re in _FAST_DEVICES:
+        for suffix, action, verb_re in (("on", "开", _FAST_ON), ("off", "关", _FAST_OFF)):
+            name = f"{cmd_type}_{suffix}"
+            # "打开(一下)(那个)灯"、"把(那个)灯(给我)打开(了/掉)" 或 "(那个)灯(给我)关掉"
+            # 设备在前时必须带"把/将"或以"关掉"结尾："灯开了""窗关了"是在陈述状态，不是指令
+            device_first = [rf"(?:把|将)(?:那个|这个)?{device_re}(?:给我|帮我|给)?{verb_re}(?:了|掉)?"]
+            if action == "关":
+                device_first.append(rf"(?:那个|这个)?{device_re}(?:给我|帮我|给)?关掉")
+            branches.append(
+                rf"(?P<{name}>{verb_re}(?:一下)?(?:那个|这个)?{device_re}|" + "|".join(device_first) + ")"
+            )
+            templates[name] = {"type": cmd_type, "device": device, "action": action}
+    branches.append(
+        r"(?P<temperature>(?:查询|查看|检测|测量|查|看看|测)(?:一下)?(?:当前|现在|室内)?的?(?:温度|室温)"
+        r"|(?:当前|现在|室内)?的?(?:温度|室温|气温)(?:是)?(?:多少度?|几度)|(?:现在|室内)(?:是)?(?:多少|几)度|测温)"
+    )
+    templates["temperature"] = {"type": "temperature", "device": "", "action": "检测"}
+    pattern = re.compile(
+        r"(?:请|麻烦)?你?(?:帮我|给我|帮忙)?(?:" + "|".join(branches) + r")(?:一下)?(?:吧|呗|啊)?"
+    )
+    return pattern, templates
+
+
+_FAST_RE, _FAST_TEMPLATES = _build_fast_path()
+
+_JSON_DECODER = json.JSONDecoder()
+
+# 对询问的简单回答直接按规则处理，不调用模型（回答需去除标点并转小写后整句匹配）
+_YES = frozenset({"好", "好的", "好啊", "是", "是的", "对", "对的", "可以", "行", "嗯", "要", "ok", "okay", "yes", "y"})
+_NO = frozenset({"不", "不用", "不用了", "不要", "不要了", "否", "取消", "算了", "no", "n"})
+# 按序号选择：如 "1"、"第一个"、"第2项"
+_PICK_RE = re.compile(r"第?([1-9一二三四五六七八九])(?:个|项)?")
+_PICK_DIGITS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+
+
+# 以下prompt的固定部分（说明、示例、输出格式）都放在最前面，对话历史、设备状态、用户输入等
+# 每次变化的内容接在 "---" 之后，使相邻两次请求的prompt前缀完全相同，Ollama可复用前缀的KV缓存
+
+# 意图分析prompt的固定部分（后接对话历史、原始语音文本）
+_INTENT_PROMPT = """你是一个智能语音助手。请分析用户的语音转文字内容，判断其意图。
 注意：用户的输入是通过语音识别（ASR）生成的，可能存在同音字错误或不完整。
 例如：“沙巴工程师”可能是“设吧（设为）...”，“非下如往”可能是“飞向...”或完全错误的识别。
 
 请先尝试结合上下文修正语音识别错误，还原用户本意，然后再判断意图。
 
-上下文：
-{conversation_history}
-
-原始语音文本："{user_input}"
-
 请执行以下步骤：
 1. 【纠错】：
    - 尝试修正语音文本中的错误。
@@ -51,34 +100,483 @@ class ModelHandler:
    - ignore: 背景噪音、自言自语、逻辑不通的乱码、或者明显不是对助手说的话。
 
 请严格按照JSON格式返回：
-{{ 
+{ 
   "corrected_text": "修正后的文本（如果无需修正或无法修正则填原文本）",
   "intent": "command" | "chat" | "ignore", 
   "reason": "判断理由" 
-}}
+}
+
+---
+"""
+
+# 指令识别prompt的固定部分（后接对话历史、设备状态和用户输入）
+_COMMAND_PROMPT = """你是一个智能家居指令识别系统。你的任务是从用户的自然语言输入中提取明确的控制指令。
+
+请注意：用户可能会使用口语化、礼貌性的表达（如"帮我..."、"请..."、"有点热"、"太暗了"），你需要忽略这些修饰语，提取核心的控制意图。
+同时，请注意用户的否定指令或修正指令（如"不要打开空调"、"不对，是关灯"），这通常意味着撤销之前的操作或确保设备处于特定状态。
+
+支持的指令类型：
+1. 开关灯（light）：开、关
+2. 开关空调（ac）：开、关
+3. 开关窗户（window）：开、关
+4. 温度检测（temperature）：检测
+
+示例：
+- "帮我把空调打开" -> {"commands": [{"type": "ac", "device": "空调", "action": "开"}], "potential": []}
+- "有点热" -> {"commands": [], "potential": [{"type": "ac", "action": "开", "suggestion": "为您打开空调？"}]}
+- "不要打开空调 开窗透气" -> {"commands": [{"type": "ac", "device": "空调", "action": "关"}, {"type": "window", "device": "窗户", "action": "开"}], "potential": []}
+- "太暗了" -> {"commands": [{"type": "light", "device": "灯", "action": "开"}], "potential": []}
+- "查看当前温度" -> {"commands": [{"type": "temperature", "device": "", "action": "检测"}], "potential": []}
+
+请严格按照JSON格式返回结果：
+- 如果包含明确指令，返回：{"commands": [指令对象列表], "potential": []}
+- 如果不包含明确指令，但可能有潜在意图，返回：{"commands": [], "potential": [潜在指令数组]}
+- 如果完全不相关，返回：{"commands": [], "potential": []}
+
+只返回JSON，不要其他文字说明。
+
+---
+"""
+
+# 解析用户回答prompt的固定部分（后接对话历史、可选操作和用户回答）
+_PARSE_PROMPT = """请分析用户的回答，判断用户想要执行哪些操作。
+- 如果用户的回答包含多个操作（如"开空调顺便测量室温"、"开空调和检测温度"等），返回所有操作的数组
+- 如果用户的回答明确指向单个操作（如"开空调"、"检测温度"等），返回该操作的完整信息
+- 如果用户的回答是模糊的肯定回答（如"好的"、"可以"、"行"、"嗯"等），优先选择第一个操作
+- 如果用户的回答完全无法确定，返回：{"type": "none"}
+
+请严格按照JSON格式返回结果：
+- 单个操作：{"type": "ac", "device": "空调", "action": "开"}
+- 多个操作：{"commands": [{"type": "ac", "device": "空调", "action": "开"}, {"type": "temperature", "device": "", "action": "检测"}]}
+- 无法确定：{"type": "none"}
+
+只返回JSON，不要其他文字说明。
+
+---
+"""
+
+# 生成询问prompt的固定部分（后接用户原话和可能的操作）
+_QUESTION_PROMPT = """请生成一个自然的询问，询问用户想要执行哪个操作。不要列出选项，而是用自然语言询问。
+只返回询问文本，不要其他说明。
+
+---
 """
+
+# 路由prompt（/api/chat 的 system 消息）：一次调用同时完成纠错、意图判断和指令识别
+_ROUTE_SYSTEM_PROMPT = """你是一个智能家居语音助手的理解模块。用户的输入是通过语音识别（ASR）生成的，可能存在同音字错误或不完整。
+
+请依次完成：
+1. 纠错：只有在非常有把握还原用户本意时（例如同音字清晰）才修正文本；如果原文完全不通顺或是无意义的随机字符，保留原文本。
+2. 判断意图（基于纠错后的文本）：
+   - command: 包含智能家居控制指令，或表达了可能需要操作设备的意图（如"有点热"）。
+   - chat: 针对助手的闲聊或提问（如你好、讲个笑话）。
+   - ignore: 背景噪音、自言自语、逻辑不通的乱码、或者明显不是对助手说的话。
+3. 提取指令（仅 command）：忽略"帮我"、"请"等修饰语；注意否定或修正（如"不要打开空调"表示关空调）。
+   支持的指令类型：light（灯，开/关）、ac（空调，开/关）、window（窗户，开/关）、temperature（温度检测，检测）。
+   明确的指令放入 commands；只是可能的意图放入 potential，并给出 suggestion（如"为您打开空调？"）。
+4. 闲聊回复（仅 chat）：在 chat_reply 中给出简短、亲切的口语回复，其他意图时为空字符串。
+
+示例：
+- "帮我把空调打开" -> {"intent": "command", "corrected_text": "帮我把空调打开", "commands": [{"type": "ac", "device": "空调", "action": "开"}], "potential": [], "chat_reply": ""}
+- "有点热" -> {"intent": "command", "corrected_text": "有点热", "commands": [], "potential": [{"type": "ac", "device": "空调", "action": "开", "suggestion": "为您打开空调？"}], "chat_reply": ""}
+- "你好呀" -> {"intent": "chat", "corrected_text": "你好呀", "commands": [], "potential": [], "chat_reply": "你好，有什么可以帮你的吗？"}
+
+只返回JSON。"""
+
+_ROUTE_COMMAND_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string", "enum": ["light", "ac", "window", "temperature"]},
+        "device": {"type": "string"},
+        "action": {"type": "string"},
+    },
+    "required": ["type", "device", "action"],
+}
+
+# 路由结果的JSON Schema（Ollama 结构化输出），字段顺序即生成顺序
+_ROUTE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": ["command", "chat", "ignore"]},
+        "corrected_text": {"type": "string"},
+        "commands": {"type": "array", "items": _ROUTE_COMMAND_SCHEMA},
+        "potential": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": dict(_ROUTE_COMMAND_SCHEMA["properties"], suggestion={"type": "string"}),
+                "required": ["type", "device", "action", "suggestion"],
+            },
+        },
+        "chat_reply": {"type": "string"},
+    },
+    "required": ["intent", "corrected_text", "commands", "potential", "chat_reply"],
+}
+
+# 支持的指令类型
+_VALID_TYPES = frozenset({"light", "ac", "window", "temperature"})
+
+
+def _normalize_command(cmd, potential_commands: list = ()) -> Optional[Dict]:
+    """
+    校验并规范化模型返回的单个指令
+    
+    Args:
+        cmd: 模型返回的指令对象
+        potential_commands: 潜在指令列表，缺少 action 时从同类型的潜在指令中补全
+        
+    Returns:
+        只含 type/device/action 的指令字典；类型不支持时返回None
+    """
+    if not isinstance(cmd, dict):
+        return None
+    cmd_type = cmd.get('type')
+    if cmd_type not in _VALID_TYPES:
+        return None
+    action = cmd.get('action')
+    if action is None:
+        action = next((p.get('action', '') for p in potential_commands if p.get('type') == cmd_type), '')
+    return {'type': cmd_type, 'device': cmd.get('device') or '', 'action': action}
+
+
+def _extract_json(text: str) -> str:
+    """
+    从模型输出中截取第一个括号配平的 {...} 片段（单次扫描，跳过字符串内的括号）
+    
+    Returns:
+        JSON片段；若没有找到完整对象则原样返回
+    """
+    start = text.find('{')
+    if start == -1:
+        return text
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text
+
+
+class ModelHandler:
+    """处理Ollama模型调用和指令识别"""
+    
+    # 响应缓存容量（按 prompt 精确匹配，LRU淘汰）
+    CACHE_SIZE = 512
+    
+    # 指令类型 -> 中文设备名（类级常量，格式化消息时不再每次构建字典）
+    _TYPE_NAMES = {
+        'light': '灯',
+        'ac': '空调',
+        'window': '窗户',
+        'temperature': '温度检测'
+    }
+    
+    def __init__(self, model_name: str = "qwen2.5:7b", base_url: str = "http://127.0.0.1:11434",
+                 num_ctx: int = 2048, num_thread: Optional[int] = None, keep_alive: str = "1h"):
+        """
+        初始化模型处理器
+        
+        Args:
+            model_name: Ollama模型名称，默认为qwen2.5:7b
+            base_url: Ollama服务地址，默认为http://127.0.0.1:11434
+            num_ctx: 上下文窗口长度，prompt加对话历史远小于默认值，调小可减少KV缓存占用
+            num_thread: 推理线程数，默认由Ollama决定
+            keep_alive: 模型在两次请求之间保持加载的时长，避免重新加载模型
+        """
+        self.model_name = model_name
+        self.base_url = base_url
+        self.api_url = f"{base_url}/api/generate"
+        self.chat_url = f"{base_url}/api/chat"
+        self.keep_alive = keep_alive
+        # 所有请求共用的生成参数
+        self.gen_options = {"num_ctx": num_ctx}
+        if num_thread:
+            self.gen_options["num_thread"] = num_thread
+        # 各类调用的生成参数：限制生成长度，避免模型输出长篇解释拖慢响应
+        # 结构化输出（意图/指令/回答解析）使用贪心解码，结果稳定且更快结束
+        json_options = dict(self.gen_options, temperature=0)
+        self._intent_options = dict(json_options, num_predict=128)
+        self._command_options = dict(json_options, num_predict=128)
+        self._parse_options = dict(json_options, num_predict=128)
+        # 路由结果可能包含闲聊回复，生成长度放宽一些
+        self._route_options = dict(json_options, num_predict=256)
+        # 询问只需一句话，遇到空行即停止
+        self._question_options = dict(self.gen_options, num_predict=96, stop=["\n\n"])
+        self._chat_options = dict(self.gen_options, num_predict=160)
+        # 复用HTTP连接（keep-alive），避免每次调用都重新建立TCP连接
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=0))
+        self._response_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 用于并发发起多个模型请求（如意图分析与指令识别同时进行）
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="model")
+        self._keep_alive_timer: Optional[threading.Timer] = None
+        # stop_warmup 置位后不再安排新的定期刷新
+        self._keep_alive_stopped = threading.Event()
+    
+    def warmup(self, refresh_interval: float = 0, timeout: float = 180) -> bool:
+        """
+        预加载模型：发送空prompt请求，Ollama只加载模型而不生成内容
+        
+        Args:
+            refresh_interval: 大于0时，每隔该秒数在后台重新发送一次，刷新模型保持加载的时间
+            timeout: 请求超时时间（秒）
+            
+        Returns:
+            是否加载成功
+        """
+        # 带上与正式请求相同的 options，否则参数不同时 Ollama 会在第一次正式请求时重新加载模型
+        data = {"model": self.model_name, "prompt": "", "options": self.gen_options, "keep_alive": self.keep_alive}
         try:
+            response = self.session.post(self.api_url, data=_dumps(data), headers=_JSON_HEADERS,
+                                         timeout=timeout)
+            response.raise_for_status()
+            ok = True
+        except Exception as e:
+            print(f"⚠ 模型预加载失败: {e}")
+            ok = False
+        
+        if refresh_interval > 0 and not self._keep_alive_stopped.is_set():
+            timer = threading.Timer(refresh_interval, self.warmup, args=(refresh_interval, timeout))
+            timer.daemon = True
+            timer.start()
+            self._keep_alive_timer = timer
+        return ok
+    
+    def stop_warmup(self):
+        """停止 warmup 安排的定期刷新"""
+        self._keep_alive_stopped.set()
+        if self._keep_alive_timer is not None:
+            self._keep_alive_timer.cancel()
+            self._keep_alive_timer = None
+    
+    def _generate(self, prompt: Union[str, Callable[[], str]], timeout: float, use_cache: bool = True,
+                  json_mode: bool = False, options: Optional[Dict] = None,
+                  cache_key: Optional[bytes] = None) -> str:
+        """
+        调用Ollama生成接口，返回模型输出文本
+        
+        相同的prompt（含对话历史和设备状态）在缓存中命中时直接返回，不再请求模型
+        
+        Args:
+            prompt: 完整的prompt，或构建prompt的函数（配合 cache_key 使用，缓存命中时不必构建）
+            timeout: 请求超时时间（秒）
+            use_cache: 是否使用响应缓存
+            json_mode: 是否要求模型输出JSON；开启后流式接收，得到完整JSON对象即停止
+            options: 生成参数，默认使用 gen_options
+            cache_key: 缓存键（见 _cache_key）；不提供时按完整prompt计算
+            
+        Returns:
+            模型返回的 response 文本（已去除首尾空白）
+        """
+        if use_cache:
+            key = cache_key
+            if key is None:
+                if callable(prompt):
+                    prompt = prompt()
+                key = hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).digest()
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
+        if callable(prompt):
+            prompt = prompt()
+        
+        if json_mode:
+            content = self._generate_json(prompt, timeout, options or self.gen_options)
+        else:
             data = {
                 "model": self.model_name,
                 "prompt": prompt,
-                "stream": False
+                "stream": False,
+                "options": options or self.gen_options,
+                "keep_alive": self.keep_alive
             }
+            response = self.session.post(self.api_url, data=_dumps(data), headers=_JSON_HEADERS,
+                                         stream=False, timeout=timeout)
+            response.raise_for_status()
+            content = _loads(response.content).get('response', '').strip()
+        
+        if use_cache:
+            self._cache_put(key, content)
+        return content
+    
+    @staticmethod
+    def _cache_key(kind: str, *fields: str) -> bytes:
+        """
+        由调用类型和构成prompt的各字段计算缓存键，无需先拼出完整prompt
+        
+        各字段之间以 \\0 分隔，避免不同字段组合拼接后相同
+        """
+        h = hashlib.blake2b(kind.encode('utf-8'), digest_size=16)
+        for field in fields:
+            h.update(b"\0")
+            h.update(field.encode('utf-8'))
+        return h.digest()
+    
+    def _cache_get(self, key: bytes) -> Optional[str]:
+        """查询响应缓存，命中时移到LRU末尾"""
+        with self._cache_lock:
+            cached = self._response_cache.get(key)
+            if cached is not None:
+                self._response_cache.move_to_end(key)
+            return cached
+    
+    def _cache_put(self, key: bytes, content: str):
+        """写入响应缓存（只缓存非空结果），超出容量时淘汰最久未用的条目"""
+        if not content:
+            return
+        with self._cache_lock:
+            self._response_cache[key] = content
+            if len(self._response_cache) > self.CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+    
+    def _generate_json(self, prompt: str, timeout: float, options: Dict) -> str:
+        """
+        以流式方式请求JSON输出，一旦拼接出完整的JSON对象就关闭连接
+        
+        Returns:
+            JSON文本；若直到生成结束都未得到完整对象，返回全部输出
+        """
+        data = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "stream": True,
+            "format": "json",  # 约束模型只输出合法JSON
+            "options": options,
+            "keep_alive": self.keep_alive
+        }
+        return self._stream_json(self.api_url, data, timeout)
+    
+    def _stream_json(self, url: str, data: Dict, timeout: float) -> str:
+        """
+        发送流式请求并拼接输出，一旦得到完整的JSON对象就关闭连接
+        
+        同时支持 /api/generate（片段在 response 字段）和 /api/chat（片段在 message.content 字段）
+        """
+        fragments = []
+        with self.session.post(url, data=_dumps(data), headers=_JSON_HEADERS,
+                               stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = _loads(line)
+                message = chunk.get('message')
+                fragment = message.get('content', '') if message else chunk.get('response', '')
+                fragments.append(fragment)
+                
+                # 出现右括号时尝试解析，完整对象到手即提前结束，不再等待后续输出
+                if '}' in fragment:
+                    text = "".join(fragments)
+                    start = text.find('{')
+                    if start != -1:
+                        try:
+                            _, end = _JSON_DECODER.raw_decode(text, start)
+                            return text[start:end]
+                        except json.JSONDecodeError:
+                            pass
+                if chunk.get('done'):
+                    break
+        return "".join(fragments).strip()
+    
+    def route(self, user_input: str, conversation_history: str = "", device_states: str = "",
+              timeout: float = 60) -> Optional[Dict]:
+        """
+        一次模型调用同时完成纠错、意图判断和指令识别（代替 analyze_intent + recognize_command）
+        
+        通过 /api/chat 发送，固定的说明放在 system 消息中，并用JSON Schema约束输出结构
+        
+        Args:
+            user_input: 用户输入的文本
+            conversation_history: 对话历史（可选）
+            device_states: 设备状态（可选）
+            timeout: 请求超时时间（秒）
+            
+        Returns:
+            字典，包含 intent、corrected_text、commands、potential、chat_reply；
+            调用或解析失败时返回None，调用方可退回 analyze_intent + recognize_command
+        """
+        # 快速路径：简单明确的指令无需调用模型
+        match = _FAST_RE.fullmatch(_FAST_PUNCT_RE.sub("", user_input))
+        if match:
+            return {"intent": "command", "corrected_text": user_input, "reason": "规则匹配",
+                    "commands": [dict(_FAST_TEMPLATES[match.lastgroup])], "potential": [], "chat_reply": ""}
+        
+        key = self._cache_key("route", user_input, conversation_history, device_states)
+        content = self._cache_get(key)
+        try:
+            if content is None:
+                context_parts = []
+                if conversation_history:
+                    context_parts.append(f"最近对话历史：\n{conversation_history}")
+                if device_states:
+                    context_parts.append(f"当前设备状态：\n{device_states}")
+                context_parts.append(f'原始语音文本："{user_input}"')
+                user_message = "\n\n".join(context_parts)
+                data = {
+                    "model": self.model_name,
+                    "messages": [
+                        {"role": "system", "content": _ROUTE_SYSTEM_PROMPT},
+                        {"role": "user", "content": user_message},
+                    ],
+                    "stream": True,
+                    "format": _ROUTE_SCHEMA,
+                    "options": self._route_options,
+                    "keep_alive": self.keep_alive
+                }
+                content = self._stream_json(self.chat_url, data, timeout)
+            result = _loads(_extract_json(content))
+        except Exception as e:
+            print(f"路由分析失败: {e}")
+            return None
+        
+        if not isinstance(result, dict) or result.get("intent") not in ("command", "chat", "ignore"):
+            return None
+        # 含闲聊回复的结果不缓存，保持回复自然多样
+        if result["intent"] != "chat":
+            self._cache_put(key, content)
+        result.setdefault("corrected_text", user_input)
+        # 与 recognize_command 相同：校验指令类型，只保留支持的指令
+        result["commands"] = [c for c in (_normalize_command(cmd) for cmd in result.get("commands") or ()) if c]
+        result["potential"] = [p for p in result.get("potential") or ()
+                               if isinstance(p, dict) and p.get("type") in _VALID_TYPES]
+        result.setdefault("chat_reply", "")
+        return result
+    
+    def analyze_intent(self, user_input: str, conversation_history: str = "") -> Dict:
+        """
+        分析用户意图：指令、闲聊还是忽略
+        """
+        def build_prompt():
+            return (_INTENT_PROMPT + "上下文：\n" + conversation_history
+                    + '\n\n原始语音文本："' + user_input + '"')
+        
+        try:
             # sys.stdout.write("正在分析意图")
             # sys.stdout.flush()
-            response = requests.post(self.api_url, json=data, stream=False, timeout=30)
-            response.raise_for_status()
+            content = self._generate(build_prompt, timeout=30, json_mode=True, options=self._intent_options,
+                                     cache_key=self._cache_key("intent", user_input, conversation_history))
             # sys.stdout.write("\r" + " " * 20 + "\r")
             
-            result_json = response.json()
-            content = result_json.get('response', '').strip()
-            
-            if '```' in content:
-                json_start = content.find('{')
-                json_end = content.rfind('}') + 1
-                if json_start != -1:
-                    content = content[json_start:json_end]
+            # 去掉代码块等包裹，只保留JSON对象
+            content = _extract_json(content)
             
-            return json.loads(content)
+            return _loads(content)
         except Exception as e:
             print(f"意图分析失败: {e}")
             # 默认保守策略：如果是短语则忽略，长语可能是闲聊
@@ -98,14 +596,8 @@ class ModelHandler:
 助手："""
         
         try:
-            data = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": False
-            }
-            response = requests.post(self.api_url, json=data, stream=False, timeout=60)
-            content = response.json().get('response', '').strip()
-            return content
+            # 闲聊回复不使用缓存，保持回复自然多样
+            return self._generate(prompt, timeout=60, use_cache=False, options=self._chat_options)
         except Exception as e:
             return "抱歉，我没听清，请再说一遍。"
 
@@ -135,33 +627,7 @@ class ModelHandler:
         if context_section:
             context_section = f"{context_section}\n\n"
         
-        prompt = f"""你是一个智能家居指令识别系统。你的任务是从用户的自然语言输入中提取明确的控制指令。
-
-请注意：用户可能会使用口语化、礼貌性的表达（如"帮我..."、"请..."、"有点热"、"太暗了"），你需要忽略这些修饰语，提取核心的控制意图。
-同时，请注意用户的否定指令或修正指令（如"不要打开空调"、"不对，是关灯"），这通常意味着撤销之前的操作或确保设备处于特定状态。
-
-支持的指令类型：
-1. 开关灯（light）：开、关
-2. 开关空调（ac）：开、关
-3. 开关窗户（window）：开、关
-4. 温度检测（temperature）：检测
-
-示例：
-- "帮我把空调打开" -> {{"commands": [{{"type": "ac", "device": "空调", "action": "开"}}], "potential": []}}
-- "有点热" -> {{"commands": [], "potential": [{{"type": "ac", "action": "开", "suggestion": "为您打开空调？"}}]}}
-- "不要打开空调 开窗透气" -> {{"commands": [{{"type": "ac", "device": "空调", "action": "关"}}, {{"type": "window", "device": "窗户", "action": "开"}}], "potential": []}}
-- "太暗了" -> {{"commands": [{{"type": "light", "device": "灯", "action": "开"}}], "potential": []}}
-- "查看当前温度" -> {{"commands": [{{"type": "temperature", "device": "", "action": "检测"}}], "potential": []}}
-
-{context_section}用户输入：{user_input}
-
-请严格按照JSON格式返回结果：
-- 如果包含明确指令，返回：{{"commands": [指令对象列表], "potential": []}}
-- 如果不包含明确指令，但可能有潜在意图，返回：{{"commands": [], "potential": [潜在指令数组]}}
-- 如果完全不相关，返回：{{"commands": [], "potential": []}}
-
-只返回JSON，不要其他文字说明。"""
-        return prompt
+        return _COMMAND_PROMPT + context_section + "用户输入：" + user_input
     
     def _build_question_prompt(self, user_input: str, potential_commands: list) -> str:
         """
@@ -186,13 +652,7 @@ class ModelHandler:
         
         options_text = "\n".join(options)
         
-        prompt = f"""用户说："{user_input}"
-可能的操作：
-{options_text}
-
-请生成一个自然的询问，询问用户想要执行哪个操作。不要列出选项，而是用自然语言询问。
-只返回询问文本，不要其他说明。"""
-        return prompt
+        return _QUESTION_PROMPT + f'用户说："{user_input}"\n可能的操作：\n{options_text}'
     
     def generate_question(self, user_input: str, potential_commands: list) -> str:
         """
@@ -208,26 +668,16 @@ class ModelHandler:
         prompt = self._build_question_prompt(user_input, potential_commands)
         
         try:
-            data = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": False
-            }
-            
             # 显示加载提示
             sys.stdout.write("正在生成询问")
             sys.stdout.flush()
             
-            response = requests.post(self.api_url, json=data, stream=False, timeout=180)
-            response.raise_for_status()
+            question = self._generate(prompt, timeout=180, options=self._question_options)
             
             # 清除加载提示
             sys.stdout.write("\r" + " " * 20 + "\r")
             sys.stdout.flush()
             
-            result_json = response.json()
-            question = result_json.get('response', '').strip()
-            
             if not question:
                 # 如果没有生成问题，使用默认询问
                 return "您想要执行什么操作？"
@@ -238,6 +688,39 @@ class ModelHandler:
             print(f"⚠ 生成询问失败: {e}")
             return "您想要执行什么操作？"
     
+    def try_direct_pick(self, user_response: str, potential_commands: list) -> Tuple[bool, Optional[Dict]]:
+        """
+        按规则处理对询问的简单回答（肯定、否定、序号），不调用模型
+        
+        Args:
+            user_response: 用户的回答
+            potential_commands: 潜在指令列表
+            
+        Returns:
+            (是否已处理, 选中的指令)；否定回答返回 (True, None)，无法按规则处理时返回 (False, None)
+        """
+        answer = _FAST_PUNCT_RE.sub("", user_response).lower()
+        if answer in _NO:
+            return True, None
+        if answer in _YES:
+            # 只有一个候选时肯定回答才无歧义，多个候选交给模型判断
+            if len(potential_commands) != 1:
+                return False, None
+            picked = 0
+        else:
+            match = _PICK_RE.fullmatch(answer)
+            if not match:
+                return False, None
+            digit = match.group(1)
+            picked = _PICK_DIGITS[digit] - 1 if digit in _PICK_DIGITS else int(digit) - 1
+        if picked >= len(potential_commands):
+            return False, None
+        # 候选可能来自客户端请求，与模型路径一样校验指令类型；不合法时交给模型处理
+        cmd = _normalize_command(potential_commands[picked], potential_commands)
+        if cmd is None:
+            return False, None
+        return True, cmd
+    
     def parse_user_response(self, user_response: str, potential_commands: list, conversation_history: str = "") -> Optional[Dict]:
         """
         解析用户的自然语言回答，识别要执行的指令
@@ -250,6 +733,11 @@ class ModelHandler:
         Returns:
             识别到的指令字典，如果没有识别到则返回None
         """
+        # 肯定/否定/序号等简单回答直接处理
+        handled, cmd = self.try_direct_pick(user_response, potential_commands)
+        if handled:
+            return cmd
+        
         # 构建选项描述
         options_desc = []
         for cmd in potential_commands:
@@ -260,54 +748,26 @@ class ModelHandler:
         
         context_section = ""
         if conversation_history:
-            context_section = f"\n对话历史：\n{conversation_history}\n\n"
+            context_section = f"对话历史：\n{conversation_history}\n\n"
         
-        prompt = f"""用户回答："{user_response}"
-{context_section}可选的操作：
-{options_text}
-
-请分析用户的回答，判断用户想要执行哪些操作。
-- 如果用户的回答包含多个操作（如"开空调顺便测量室温"、"开空调和检测温度"等），返回所有操作的数组
-- 如果用户的回答明确指向单个操作（如"开空调"、"检测温度"等），返回该操作的完整信息
-- 如果用户的回答是模糊的肯定回答（如"好的"、"可以"、"行"、"嗯"等），优先选择第一个操作
-- 如果用户的回答完全无法确定，返回：{{"type": "none"}}
-
-请严格按照JSON格式返回结果：
-- 单个操作：{{"type": "ac", "device": "空调", "action": "开"}}
-- 多个操作：{{"commands": [{{"type": "ac", "device": "空调", "action": "开"}}, {{"type": "temperature", "device": "", "action": "检测"}}]}}
-- 无法确定：{{"type": "none"}}
-
-只返回JSON，不要其他文字说明。"""
+        prompt = (_PARSE_PROMPT + context_section + "可选的操作：\n" + options_text
+                  + '\n\n用户回答："' + user_response + '"')
         
         try:
-            data = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": False
-            }
-            
             # 显示加载提示
             sys.stdout.write("正在解析回答")
             sys.stdout.flush()
             
-            response = requests.post(self.api_url, json=data, stream=False, timeout=180)
-            response.raise_for_status()
+            content = self._generate(prompt, timeout=180, json_mode=True, options=self._parse_options)
             
             # 清除加载提示
             sys.stdout.write("\r" + " " * 20 + "\r")
             sys.stdout.flush()
             
-            result_json = response.json()
-            content = result_json.get('response', '').strip()
-            
             # 提取JSON
-            if '```' in content:
-                json_start = content.find('{')
-                json_end = content.rfind('}') + 1
-                if json_start != -1 and json_end > json_start:
-                    content = content[json_start:json_end]
+            content = _extract_json(content)
             
-            result = json.loads(content)
+            result = _loads(content)
             
             # 检查是否识别到指令
             if result.get('type') == 'none':
@@ -315,39 +775,12 @@ class ModelHandler:
             
             # 检查是否有多个指令
             if 'commands' in result and isinstance(result['commands'], list):
-                # 多个指令，返回列表
-                commands = []
-                valid_types = ['light', 'ac', 'window', 'temperature']
-                for cmd in result['commands']:
-                    if cmd.get('type') in valid_types:
-                        # 补充缺失的字段
-                        if 'device' not in cmd:
-                            cmd['device'] = ''
-                        if 'action' not in cmd:
-                            # 从potential_commands中找到匹配的action
-                            for potential_cmd in potential_commands:
-                                if potential_cmd.get('type') == cmd.get('type'):
-                                    cmd['action'] = potential_cmd.get('action', '')
-                                    break
-                        commands.append(cmd)
+                # 多个指令，返回列表（校验类型并补充缺失的字段）
+                commands = [c for c in (_normalize_command(cmd, potential_commands) for cmd in result['commands']) if c]
                 return commands if commands else None
             
             # 单个指令
-            valid_types = ['light', 'ac', 'window', 'temperature']
-            if result.get('type') not in valid_types:
-                return None
-            
-            # 补充缺失的字段
-            if 'device' not in result:
-                result['device'] = ''
-            if 'action' not in result:
-                # 从potential_commands中找到匹配的action
-                for cmd in potential_commands:
-                    if cmd.get('type') == result.get('type'):
-                        result['action'] = cmd.get('action', '')
-                        break
-            
-            return result
+            return _normalize_command(result, potential_commands)
             
         except Exception as e:
             print(f"⚠ 解析用户回答失败: {e}")
@@ -367,72 +800,50 @@ class ModelHandler:
             - commands: 指令列表
             - potential: 潜在指令列表（如果有）
         """
-        prompt = self._build_prompt(user_input, conversation_history, device_states)
+        # 快速路径：简单明确的指令无需调用模型
+        match = _FAST_RE.fullmatch(_FAST_PUNCT_RE.sub("", user_input))
+        if match:
+            return {'commands': [dict(_FAST_TEMPLATES[match.lastgroup])], 'potential': []}
+        
+        # 缓存键直接由各字段计算，缓存命中时不必构建prompt
+        cache_key = self._cache_key("command", user_input, conversation_history, device_states)
         
+        content = ""
         try:
-            # 调用Ollama API (使用generate端点，参考llm_test.py)
-            data = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "stream": False  # 非流式输出
-            }
-            
             # 显示加载提示
             sys.stdout.write("正在处理")
             sys.stdout.flush()
             
+            # 调用Ollama API（使用generate端点，参考llm_test.py）
             # 使用较长的超时时间（180秒），因为模型首次加载或处理可能需要较长时间
-            response = requests.post(self.api_url, json=data, stream=False, timeout=180)
-            response.raise_for_status()  # 检查HTTP错误
+            content = self._generate(lambda: self._build_prompt(user_input, conversation_history, device_states),
+                                     timeout=180, json_mode=True, options=self._command_options,
+                                     cache_key=cache_key)
             
             # 清除加载提示
             sys.stdout.write("\r" + " " * 20 + "\r")  # 清除提示行
             sys.stdout.flush()
             
-            # 解析响应
-            result_json = response.json()
-            content = result_json.get('response', '').strip()
-            
             if not content:
                 print("⚠ 警告: 模型返回内容为空")
                 return {'commands': [], 'potential': []}
             
             # 尝试解析JSON
-            # 如果返回的内容包含代码块，提取JSON部分
-            if '```' in content:
-                # 提取代码块中的JSON
-                json_start = content.find('{')
-                json_end = content.rfind('}') + 1
-                if json_start != -1 and json_end > json_start:
-                    content = content[json_start:json_end]
-            
-            result = json.loads(content)
-            
-            # 确保有potential字段
-            if 'potential' not in result:
-                result['potential'] = []
-            
-            # 确保有commands字段
-            if 'commands' not in result:
-                result['commands'] = []
-                # 兼容旧格式：如果返回了单指令格式
-                if result.get('type') and result.get('type') != 'none':
-                    result['commands'] = [{
-                        'type': result.get('type'),
-                        'device': result.get('device', ''),
-                        'action': result.get('action', '')
-                    }]
+            # 如果返回的内容包含代码块等包裹，提取其中的JSON对象
+            content = _extract_json(content)
             
-            # 验证指令类型
-            valid_types = ['light', 'ac', 'window', 'temperature']
-            valid_commands = []
-            for cmd in result['commands']:
-                if cmd.get('type') in valid_types:
-                    valid_commands.append(cmd)
+            result = _loads(content)
+            
+            commands = result.get('commands')
+            if commands is None:
+                # 兼容旧格式：如果返回了单指令格式
+                commands = [result]
             
-            result['commands'] = valid_commands
+            # 验证指令类型，只保留支持的指令
+            valid_commands = [c for c in (_normalize_command(cmd) for cmd in commands or ()) if c]
+            potential = [p for p in result.get('potential') or () if isinstance(p, dict) and p.get('type') in _VALID_TYPES]
             
-            return result
+            return {'commands': valid_commands, 'potential': potential}
             
         except requests.exceptions.Timeout as e:
             sys.stdout.write("\r" + " " * 20 + "\r")  # 清除加载提示
@@ -460,6 +871,15 @@ class ModelHandler:
             print()
             return {'commands': [], 'potential': []}
     
+    def recognize_command_async(self, user_input: str, conversation_history: str = "", device_states: str = "") -> Future:
+        """
+        在后台线程中识别指令，参数同 recognize_command
+        
+        Returns:
+            Future，结果为 recognize_command 的返回值
+        """
+        return self._pool.submit(self.recognize_command, user_input, conversation_history, device_states)
+    
     def format_command_message(self, command: Dict) -> str:
         """
         格式化指令为可读的中文消息
@@ -470,18 +890,31 @@ class ModelHandler:
         Returns:
             格式化的中文消息
         """
-        type_map = {
-            'light': '灯',
-            'ac': '空调',
-            'window': '窗户',
-            'temperature': '温度检测'
-        }
-        
         device = command.get('device', '')
         action = command.get('action', '')
-        cmd_type = type_map.get(command.get('type', ''), '未知设备')
+        cmd_type = self._TYPE_NAMES.get(command.get('type', ''), '未知设备')
         
         if command.get('type') == 'temperature':
             return f"执行{cmd_type}"
         else:
             return f"{action}{device or cmd_type}"
+
+
+if __name__ == "__main__":
+    # 测试代码：快速路径只接受明确的指令
+    for text in ("打开灯", "把灯关了", "把空调打开吧", "窗户给我关掉", "灯关掉", "现在几度"):
+        assert _FAST_RE.fullmatch(_FAST_PUNCT_RE.sub("", text)), text
+    for text in ("灯开了", "窗关了", "空调开了", "灯开着", "空调开掉", "别开灯"):
+        assert not _FAST_RE.fullmatch(_FAST_PUNCT_RE.sub("", text)), text
+    print("快速路径测试通过")
+    
+    # 测试代码：简单回答的规则处理
+    handler = ModelHandler()
+    light = {"type": "light", "device": "灯", "action": "开"}
+    ac = {"type": "ac", "device": "空调", "action": "开"}
+    assert handler.try_direct_pick("好", [light]) == (True, light)
+    assert handler.try_direct_pick("好", [light, ac]) == (False, None)
+    assert handler.try_direct_pick("第二个", [light, ac]) == (True, ac)
+    assert handler.try_direct_pick("1", [{"type": "door", "action": "开"}]) == (False, None)
+    assert handler.try_direct_pick("不用了", [light, ac]) == (True, None)
+    print("简单回答测试通过")
@@ -3,11 +3,25 @@ MQTT客户端模块
 用于发送智能家居指令到MQTT broker
 """
 import json
+import logging
+import threading
+import time
 import paho.mqtt.client as mqtt
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import os
 
+# 优先使用 orjson 序列化消息（C实现，直接输出UTF-8字节，paho可直接发送），不可用时退回标准库
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+# 逐条消息的发送日志走 logging，级别过滤后不再格式化和写 stdout
+log = logging.getLogger(__name__)
+
 # 尝试使用本地broker模拟器（默认启用，因为大多数情况下没有外部broker）
 USE_LOCAL_BROKER = os.getenv('USE_LOCAL_BROKER', 'true').lower() == 'true'
 if USE_LOCAL_BROKER:
@@ -23,6 +37,11 @@ else:
 class MQTTClient:
     """MQTT客户端，用于发送智能家居指令"""
     
+    # 默认以 QoS 0 发布（开关类指令无需等待 PUBACK）；指令字典中的 qos 字段可单独覆盖
+    DEFAULT_QOS = 0
+    # 批量发送时等待最后一条消息发出的最长时间（秒）
+    PUBLISH_TIMEOUT = 5
+    
     def __init__(self, broker: str = "localhost", port: int = 1883, topic: str = "smart_home/command"):
         """
         初始化MQTT客户端
@@ -37,6 +56,8 @@ class MQTTClient:
         self.topic = topic
         self.client = None
         self.connected = False
+        # 连接成功时由回调置位，connect 等待它而不是轮询
+        self._connected_event = threading.Event()
     
     def connect(self) -> bool:
         """
@@ -52,6 +73,7 @@ class MQTTClient:
             return True
         
         try:
+            self._connected_event.clear()
             self.client = mqtt.Client()
             self.client.on_connect = self._on_connect
             self.client.on_disconnect = self._on_disconnect
@@ -59,13 +81,8 @@ class MQTTClient:
             self.client.connect(self.broker, self.port, 60)
             self.client.loop_start()
             
-            # 等待连接建立
-            import time
-            timeout = 5
-            start_time = time.time()
-            while not self.connected and (time.time() - start_time) < timeout:
-                time.sleep(0.1)
-            
+            # 等待连接建立（最多5秒）
+            self._connected_event.wait(timeout=5)
             return self.connected
         except Exception as e:
             print(f"MQTT连接错误: {e}")
@@ -85,10 +102,13 @@ class MQTTClient:
         else:
             print(f"✗ MQTT连接失败，错误代码: {rc}")
             self.connected = False
+        # 无论成功失败都唤醒等待中的 connect
+        self._connected_event.set()
     
     def _on_disconnect(self, client, userdata, rc):
         """断开连接回调函数"""
         self.connected = False
+        self._connected_event.clear()
         if rc != 0:
             print("MQTT意外断开连接")
     
@@ -107,41 +127,108 @@ class MQTTClient:
             if not self.connect():
                 return False
         
-        # 构建消息
-        message = {
-            "type": command.get("type"),
-            "device": command.get("device", ""),
-            "action": command.get("action", ""),
-            "timestamp": datetime.now().isoformat()
-        }
-        
         try:
-            # 转换为JSON并发送
-            payload = json.dumps(message, ensure_ascii=False)
+            # 转换为JSON字节串并发送
+            payload = self._build_payload(command, command.get("timestamp") or datetime.now().isoformat())
             
-            # 如果使用本地broker
+            # 如果使用本地broker（消息文件中的payload为字符串）
             if LOCAL_BROKER_AVAILABLE and (USE_LOCAL_BROKER or not self.client):
+                payload_text = payload.decode('utf-8')
                 broker = get_broker()
-                broker.publish(self.topic, payload)
-                print(f"✓ MQTT消息已发送到主题: {self.topic} (本地模拟器)")
-                print(f"  消息内容: {payload}")
+                broker.publish(self.topic, payload_text)
+                log.info("✓ MQTT消息已发送到主题: %s (本地模拟器)", self.topic)
+                log.debug("  消息内容: %s", payload_text)
                 return True
             
             # 使用真实MQTT broker
-            result = self.client.publish(self.topic, payload, qos=1)
+            result = self.client.publish(self.topic, payload, qos=command.get('qos', self.DEFAULT_QOS))
             
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"✓ MQTT消息已发送到主题: {self.topic}")
-                print(f"  消息内容: {payload}")
+                log.info("✓ MQTT消息已发送到主题: %s", self.topic)
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("  消息内容: %s", payload.decode('utf-8'))
                 return True
             else:
-                print(f"✗ MQTT消息发送失败，错误代码: {result.rc}")
+                log.error("✗ MQTT消息发送失败，错误代码: %s", result.rc)
                 return False
                 
         except Exception as e:
-            print(f"发送MQTT消息时出错: {e}")
+            log.error("发送MQTT消息时出错: %s", e)
             return False
     
+    def send_commands(self, commands: List[Dict]) -> List[bool]:
+        """
+        批量发送多条智能家居指令（同一轮对话中的多个指令）
+        
+        一次性构建所有消息，连续发布，不在每条之间等待
+        
+        Args:
+            commands: 指令字典列表
+            
+        Returns:
+            每条指令是否发送成功
+        """
+        if not commands:
+            return []
+        if not self.connected:
+            print("MQTT未连接，尝试连接...")
+            if not self.connect():
+                return [False] * len(commands)
+        
+        try:
+            # 同一批指令共用一个时间戳（指令自带时间戳时保留）
+            timestamp = datetime.now().isoformat()
+            payloads = [self._build_payload(command, command.get("timestamp") or timestamp) for command in commands]
+            
+            # 如果使用本地broker：一次写入全部消息
+            if LOCAL_BROKER_AVAILABLE and (USE_LOCAL_BROKER or not self.client):
+                payload_texts = [payload.decode('utf-8') for payload in payloads]
+                ok = get_broker().publish_batch(self.topic, payload_texts)
+                if ok:
+                    log.info("✓ %d 条MQTT消息已发送到主题: %s (本地模拟器)", len(payloads), self.topic)
+                    if log.isEnabledFor(logging.DEBUG):
+                        for payload_text in payload_texts:
+                            log.debug("  消息内容: %s", payload_text)
+                return [bool(ok)] * len(payloads)
+            
+            # 使用真实MQTT broker：连续发布，由网络线程依次发出
+            qos_levels = [command.get('qos', self.DEFAULT_QOS) for command in commands]
+            infos = [self.client.publish(self.topic, payload, qos=qos) for payload, qos in zip(payloads, qos_levels)]
+            results = [info.rc == mqtt.MQTT_ERR_SUCCESS for info in infos]
+            
+            # QoS>0 的消息需逐条等待 PUBACK；QoS 0 的消息按发布顺序发出，只需等待最后一条。
+            # 所有等待共用一个截止时间，超时未完成的消息记为发送失败
+            pending = [info for info, qos, ok in zip(infos, qos_levels, results) if ok and qos > 0]
+            if results[-1] and qos_levels[-1] == 0:
+                pending.append(infos[-1])
+            deadline = time.monotonic() + self.PUBLISH_TIMEOUT
+            for info in pending:
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    info.wait_for_publish(timeout=remaining)
+            published = [ok and info.is_published() for info, ok in zip(infos, results)]
+            if published != results:
+                log.warning("⚠ %d 条MQTT消息在 %s 秒内未完成发送", results.count(True) - published.count(True),
+                            self.PUBLISH_TIMEOUT)
+            results = published
+            log.info("✓ %d/%d 条MQTT消息已发送到主题: %s", sum(results), len(payloads), self.topic)
+            return results
+            
+        except Exception as e:
+            log.error("发送MQTT消息时出错: %s", e)
+            return [False] * len(commands)
+    
+    @staticmethod
+    def _build_payload(command: Dict, timestamp: str) -> bytes:
+        """构建指令消息的JSON字节串"""
+        message = {
+            "type": command.get("type"),
+            "device": command.get("device", ""),
+            "action": command.get("action", ""),
+            "timestamp": timestamp
+        }
+        return _dumps(message)
+    
     def disconnect(self):
         """断开MQTT连接"""
         if self.client:
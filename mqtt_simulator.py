@@ -3,11 +3,26 @@ MQTT模拟接收器
 用于模拟接收智能家居指令消息
 """
 import json
+import logging
 import paho.mqtt.client as mqtt
 from datetime import datetime
 import queue
 import threading
 import os
+from typing import Optional
+
+# 优先使用 orjson 解析/格式化消息（C实现，可直接解析字节串），不可用时退回标准库
+try:
+    import orjson
+    _loads = orjson.loads
+    def _pretty(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+except ImportError:
+    _loads = json.loads
+    def _pretty(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, indent=2)
+
+log = logging.getLogger(__name__)
 
 # 尝试使用本地broker模拟器
 USE_LOCAL_BROKER = os.getenv('USE_LOCAL_BROKER', 'true').lower() == 'true'
@@ -24,7 +39,27 @@ else:
 class MQTTSimulator:
     """MQTT模拟接收器，用于测试MQTT消息接收"""
     
-    def __init__(self, broker: str = "localhost", port: int = 1883, topic: str = "smart_home/command"):
+    # 指令类型 -> 中文设备名
+    _TYPE_NAMES = {
+        'light': '灯',
+        'ac': '空调',
+        'window': '窗户',
+        'temperature': '温度检测'
+    }
+    
+    # (指令类型, 动作) -> 设备反馈
+    _FEEDBACK = {
+        ('light', '开'): "✅ 已经打开了灯",
+        ('light', '关'): "✅ 已经关闭了灯",
+        ('ac', '开'): "✅ 已经打开了空调",
+        ('ac', '关'): "✅ 已经关闭了空调",
+        ('window', '开'): "✅ 已经打开了窗户",
+        ('window', '关'): "✅ 已经关闭了窗户",
+        ('temperature', '检测'): "✅ 当前温度：25°C（模拟数据）",
+    }
+    
+    def __init__(self, broker: str = "localhost", port: int = 1883, topic: str = "smart_home/command",
+                 verbose: Optional[bool] = None):
         """
         初始化MQTT模拟接收器
         
@@ -32,7 +67,12 @@ class MQTTSimulator:
             broker: MQTT broker地址，默认localhost
             port: MQTT broker端口，默认1883
             topic: 订阅主题，默认smart_home/command
+            verbose: 是否打印完整的格式化消息；默认读取环境变量 MQTT_SIM_VERBOSE（'1' 开启），
+                     关闭时每条消息只打印一行摘要
         """
+        if verbose is None:
+            verbose = os.getenv('MQTT_SIM_VERBOSE', '0') == '1'
+        self.verbose = verbose
         self.broker = broker
         self.port = port
         self.topic = topic
@@ -56,10 +96,9 @@ class MQTTSimulator:
     def _on_message(self, client, userdata, msg):
         """消息接收回调函数（真实MQTT broker）"""
         try:
-            # 解析JSON消息
-            payload = msg.payload.decode('utf-8')
-            message = json.loads(payload)
-            self._process_message({'topic': msg.topic, 'payload': payload})
+            # 解析JSON消息（直接解析字节串）
+            message = _loads(msg.payload)
+            self._process_message({'topic': msg.topic, 'payload': message})
         except json.JSONDecodeError as e:
             print(f"\n✗ JSON解析错误: {e}")
             print(f"原始消息: {msg.payload.decode('utf-8')}\n")
@@ -71,39 +110,38 @@ class MQTTSimulator:
         try:
             # 解析payload
             if isinstance(message_data.get('payload'), str):
-                message = json.loads(message_data['payload'])
+                message = _loads(message_data['payload'])
             else:
                 message = message_data.get('payload', message_data)
             
-            # 格式化显示
-            print("\n" + "=" * 60)
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 收到新消息")
-            print("-" * 60)
-            print(f"主题: {message_data.get('topic', self.topic)}")
-            print(f"消息内容:")
-            print(json.dumps(message, ensure_ascii=False, indent=2))
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
             # 解析指令类型
             cmd_type = message.get('type', '')
             device = message.get('device', '')
             action = message.get('action', '')
             
-            type_map = {
-                'light': '灯',
-                'ac': '空调',
-                'window': '窗户',
-                'temperature': '温度检测'
-            }
-            
-            device_name = type_map.get(cmd_type, '未知设备')
+            device_name = self._TYPE_NAMES.get(cmd_type, '未知设备')
             if device:
                 device_name = device
             
-            print("-" * 60)
-            print(f"指令解析: {action}{device_name}")
-            
             # 生成执行反馈
             feedback = self._generate_feedback(cmd_type, action, device_name)
+            
+            if not self.verbose:
+                # 默认只记录一行摘要，省去逐条缩进格式化
+                log.info("[%s] %s/%s -> %s", timestamp, cmd_type, action, feedback)
+                return
+            
+            # 格式化显示
+            print("\n" + "=" * 60)
+            print(f"[{timestamp}] 收到新消息")
+            print("-" * 60)
+            print(f"主题: {message_data.get('topic', self.topic)}")
+            print(f"消息内容:")
+            print(_pretty(message))
+            print("-" * 60)
+            print(f"指令解析: {action}{device_name}")
             print(f"💬 设备反馈: {feedback}")
             print("=" * 60 + "\n")
             
@@ -125,26 +163,7 @@ class MQTTSimulator:
         Returns:
             反馈文本
         """
-        if cmd_type == 'light':
-            if action == '开':
-                return "✅ 已经打开了灯"
-            elif action == '关':
-                return "✅ 已经关闭了灯"
-        elif cmd_type == 'ac':
-            if action == '开':
-                return "✅ 已经打开了空调"
-            elif action == '关':
-                return "✅ 已经关闭了空调"
-        elif cmd_type == 'window':
-            if action == '开':
-                return "✅ 已经打开了窗户"
-            elif action == '关':
-                return "✅ 已经关闭了窗户"
-        elif cmd_type == 'temperature':
-            if action == '检测':
-                return f"✅ 当前温度：25°C（模拟数据）"
-        
-        return f"✅ 已执行：{action}{device_name}"
+        return self._FEEDBACK.get((cmd_type, action)) or f"✅ 已执行：{action}{device_name}"
     
     def start(self):
         """启动模拟接收器"""
@@ -162,14 +181,15 @@ class MQTTSimulator:
                 print("等待接收智能家居指令消息...")
                 print("=" * 60)
                 
-                # 启动文件读取线程
-                broker.running = True
-                read_thread = threading.Thread(
-                    target=broker.read_messages,
-                    args=(self.message_queue, [self.topic]),
-                    daemon=True
-                )
-                read_thread.start()
+                # 启动文件读取线程（broker不写消息文件时，消息直接投递到订阅队列）
+                if broker.persist:
+                    broker.running = True
+                    read_thread = threading.Thread(
+                        target=broker.read_messages,
+                        args=(self.message_queue, [self.topic]),
+                        daemon=True
+                    )
+                    read_thread.start()
                 
                 self.running = True
                 print("\n开始监听消息...\n")
@@ -218,5 +238,6 @@ class MQTTSimulator:
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format="%(message)s")
     simulator = MQTTSimulator()
     simulator.start()
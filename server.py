@@ -1,9 +1,14 @@
 
+import os
+import logging
+import threading
+from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+from datetime import datetime
 
 from model_handler import ModelHandler
 from mqtt_client import MQTTClient
@@ -11,7 +16,20 @@ from conversation_manager import ConversationManager
 from device_state import DeviceState
 from context_manager import ContextManager
 
-app = FastAPI()
+# Per-message MQTT logs go through logging; LOG_LEVEL=DEBUG also shows payloads
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format="%(message)s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the model in the background so startup (and importing this module) never
+    # blocks on Ollama, then keep it resident until shutdown
+    print("Loading model...")
+    threading.Thread(target=model_handler.warmup, kwargs={"refresh_interval": 20 * 60},
+                     name="model-warmup", daemon=True).start()
+    yield
+    model_handler.stop_warmup()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS for frontend development
 app.add_middleware(
@@ -28,6 +46,9 @@ device_state = DeviceState()
 context_manager = ContextManager(conversation_manager, device_state)
 model_handler = ModelHandler(model_name="qwen2.5:7b")
 mqtt_client = MQTTClient()
+# Sync handlers run concurrently in the threadpool; this lock guards the shared
+# conversation/device state. Model calls and MQTT publishes stay outside it.
+_state_lock = threading.Lock()
 
 # Initialize connection
 print("Connecting to MQTT...")
@@ -44,22 +65,25 @@ class ChatResponse(BaseModel):
     text: str
     data: Optional[Any] = None  # potential commands or executed commands
 
+# Handlers that call the model or publish over MQTT are plain `def`: FastAPI runs them
+# in its worker threadpool, so blocking I/O does not stall the event loop
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+def chat(request: ChatRequest):
     user_input = request.message.strip()
     if not user_input:
         return ChatResponse(type="error", text="Input cannot be empty")
 
-    conversation_manager.add_message("user", user_input)
-    
-    # Resolve pronouns
-    resolved_input = user_input
-    resolved = context_manager.resolve_pronoun(user_input)
-    if resolved:
-        resolved_input = resolved
-        print(f"Resolved pronoun: {resolved}")
-
-    conversation_history = conversation_manager.get_full_context()
+    with _state_lock:
+        conversation_manager.add_message("user", user_input)
+        
+        # Resolve pronouns
+        resolved_input = user_input
+        resolved = context_manager.resolve_pronoun(user_input)
+        if resolved:
+            resolved_input = resolved
+            print(f"Resolved pronoun: {resolved}")
+
+        conversation_history = conversation_manager.get_full_context()
     
     # Case 1: Handling potential command response
     if request.potential_commands:
@@ -89,7 +113,8 @@ async def chat(request: ChatRequest):
 
     # Case 2: New command recognition
     print(f"Recognizing command: {resolved_input}")
-    device_states = device_state.get_state_summary()
+    with _state_lock:
+        device_states = device_state.get_state_summary()
     result = model_handler.recognize_command(resolved_input, conversation_history, device_states)
 
     # Direct command
@@ -101,7 +126,8 @@ async def chat(request: ChatRequest):
              msg_text = ", ".join(response_texts)
              # Store commands in history
              command_data = {"commands": commands}
-             conversation_manager.add_message("assistant", f"已执行指令: {msg_text}", command_data)
+             with _state_lock:
+                 conversation_manager.add_message("assistant", f"已执行指令: {msg_text}", command_data)
              return ChatResponse(type="success", text=f"已执行: {msg_text}", data=commands)
         else:
              return ChatResponse(type="error", text="指令发送失败")
@@ -110,7 +136,8 @@ async def chat(request: ChatRequest):
     if result.get('potential'):
         potential_commands = result.get('potential', [])
         question = model_handler.generate_question(user_input, potential_commands)
-        conversation_manager.add_message("assistant", question)
+        with _state_lock:
+            conversation_manager.add_message("assistant", question)
         return ChatResponse(
             type="question",
             text=question,
@@ -118,7 +145,8 @@ async def chat(request: ChatRequest):
         )
 
     # No command
-    conversation_manager.add_message("assistant", "未识别到智能家居相关指令")
+    with _state_lock:
+        conversation_manager.add_message("assistant", "未识别到智能家居相关指令")
     return ChatResponse(type="none", text="未识别到智能家居相关指令")
 
 def execute_commands(commands: List[Dict]) -> List[str]:
@@ -126,16 +154,20 @@ def execute_commands(commands: List[Dict]) -> List[str]:
     if not mqtt_available:
         return ["MQTT不可用 (模拟执行)"]
         
-    for cmd in commands:
-        if mqtt_client.send_command(cmd):
-            device_state.update_state(cmd)
-            formatted = model_handler.format_command_message(cmd)
-            response_texts.append(formatted)
+    # 一次批量发送，再按结果更新状态
+    results = mqtt_client.send_commands(commands)
+    with _state_lock:
+        for cmd, ok in zip(commands, results):
+            if ok:
+                device_state.update_state(cmd)
+                formatted = model_handler.format_command_message(cmd)
+                response_texts.append(formatted)
     return response_texts
 
 @app.get("/api/state")
-async def get_state():
-    return device_state.get_all_states()
+def get_state():
+    with _state_lock:
+        return device_state.get_all_states()
 
 class ControlRequest(BaseModel):
     type: str
@@ -143,7 +175,7 @@ class ControlRequest(BaseModel):
     device: Optional[str] = None
 
 @app.post("/api/control")
-async def control_device(request: ControlRequest):
+def control_device(request: ControlRequest):
     command = {
         "type": request.type,
         "action": request.action,
@@ -151,18 +183,19 @@ async def control_device(request: ControlRequest):
     }
     
     # Generate timestamp
-    from datetime import datetime
     command["timestamp"] = datetime.now().isoformat()
 
     if mqtt_available:
         if mqtt_client.send_command(command):
-            device_state.update_state(command)
+            with _state_lock:
+                device_state.update_state(command)
             return {"status": "success", "message": f"已{request.action}{request.device or request.type}"}
         else:
             raise HTTPException(status_code=500, detail="MQTT发送失败")
     else:
         # Simulation mode
-        device_state.update_state(command)
+        with _state_lock:
+            device_state.update_state(command)
         return {"status": "success", "message": f"模拟执行: 已{request.action}{request.device or request.type}"}
 
 
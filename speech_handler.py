@@ -4,22 +4,50 @@
 """
 import os
 import asyncio
+import numpy as np
 import edge_tts
 from funasr import AutoModel
 from pydub import AudioSegment
 import io
-import wave
 import sys
 import contextlib
+import threading
+from typing import Optional
+
+# 推理时关闭 autograd 记录；torch 不可用时退化为空上下文
+try:
+    import torch
+    _inference_mode = torch.inference_mode
+except ImportError:
+    _inference_mode = contextlib.nullcontext
 
 # 抑制 FunASR 的部分日志
 os.environ["MODELSCOPE_LOG_LEVEL"] = "ERROR"
 
 class SpeechHandler:
-    def __init__(self, model_name: str = "paraformer-zh", tts_voice: str = "zh-CN-XiaoxiaoNeural"):
+    def __init__(self, model_name: str = "paraformer-zh", tts_voice: str = "zh-CN-XiaoxiaoNeural",
+                 quantize: Optional[bool] = None):
+        """
+        Args:
+            model_name: FunASR 语音识别模型
+            tts_voice: edge-tts 发音人
+            quantize: 是否将识别模型的线性层动态量化为 int8（速度更快、内存更小，精度略有下降）；
+                      动态量化只支持CPU，开启时模型在CPU上运行。默认读取环境变量 ASR_QUANTIZE（默认 false）
+        """
+        if quantize is None:
+            quantize = os.getenv('ASR_QUANTIZE', 'false').lower() == 'true'
         self.model_name = model_name
         self.tts_voice = tts_voice
         self.asr_model = None
+        # 串行化识别调用，避免多个线程同时进入 torch 推理互相争抢
+        self._asr_lock = threading.Lock()
+        
+        # TTS 使用常驻的事件循环（后台线程），避免每次合成都创建、销毁事件循环
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="tts-loop", daemon=True)
+        self._loop_thread.start()
+        # 播放用的 PyAudio 实例，首次播放时创建并复用
+        self._pa = None
         
         print(f"[*] 正在加载语音识别模型: {model_name} ...")
         try:
@@ -27,6 +55,8 @@ class SpeechHandler:
             # with contextlib.redirect_stdout(io.StringIO()):
             # 定义热词：增强对智能家居指令的识别敏感度
             hotwords = "打开空调 关闭空调 开灯 关灯 检测温度 查询温度 多少度 你好 小爱 窗户 关窗 开窗"
+            # 动态量化只支持CPU，开启时在CPU上加载模型
+            device_kwargs = {"device": "cpu"} if quantize else {}
             
             self.asr_model = AutoModel(model=model_name, 
                                      model_revision="v2.0.4",
@@ -35,12 +65,42 @@ class SpeechHandler:
                                      punc_model="ct-punc-c", 
                                      punc_model_revision="v2.0.4",
                                      disable_update=True,
-                                     hotword=hotwords) # 注入热词
+                                     hotword=hotwords, # 注入热词
+                                     **device_kwargs)
+            if quantize:
+                self._quantize_models()
+            self._warmup()
             print("[✓] 语音模型加载完成")
         except Exception as e:
             print(f"[!] 语音模型加载失败: {e}")
             print("请确保已安装 funasr, modelscope, torch 等依赖")
 
+    def _warmup(self):
+        """用 0.1 秒静音跑一次识别，让首个真实语音不再承担初始化开销"""
+        try:
+            with _inference_mode():
+                self.asr_model.generate(input=np.zeros(1600, dtype=np.float32), fs=16000)
+        except Exception as e:
+            print(f"[!] 语音模型预热失败: {e}")
+
+    def _quantize_models(self):
+        """对识别、VAD、标点模型的 Linear 层做 int8 动态量化（先移到CPU）"""
+        try:
+            import torch
+            quantized = []
+            for attr in ("model", "vad_model", "punc_model"):
+                module = getattr(self.asr_model, attr, None)
+                if isinstance(module, torch.nn.Module):
+                    setattr(self.asr_model, attr,
+                            torch.quantization.quantize_dynamic(module.cpu(), {torch.nn.Linear}, dtype=torch.qint8))
+                    quantized.append(attr)
+            if quantized:
+                print(f"[✓] 语音模型已量化为 int8: {', '.join(quantized)}")
+            else:
+                print("[!] 未找到可量化的语音模型，继续使用原精度")
+        except Exception as e:
+            print(f"[!] 语音模型量化失败，继续使用原精度: {e}")
+
     def speech_to_text(self, audio_data: bytes) -> str:
         """
         将音频数据转换为文本
@@ -53,24 +113,14 @@ class SpeechHandler:
             return ""
         
         try:
-            # FunASR 接受音频路径或 numpy array 或 bytes
-            # 这里我们先保存为临时wav文件传入，或者直接传bytes如果支持
-            # AutoModel通常支持 input=audio_bytes
-            
-            # 为了稳健性，保存为临时文件
-            temp_wav = "temp_speech.wav"
-            with wave.open(temp_wav, "wb") as wf:
-                wf.setnchannels(1)
-                wf.setsampwidth(2) # 16 bit
-                wf.setframerate(16000)
-                wf.writeframes(audio_data)
+            # FunASR 接受音频路径或 numpy array：直接在内存中转换为 [-1, 1) 的 float32 波形，
+            # 不再写临时wav文件再让模型读回
+            audio_np = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32)
+            audio_np *= 1.0 / 32768.0
             
-            res = self.asr_model.generate(input=temp_wav, batch_size_s=300)
+            with self._asr_lock, _inference_mode():
+                res = self.asr_model.generate(input=audio_np, fs=16000, batch_size_s=300)
             
-            # 清理
-            if os.path.exists(temp_wav):
-                os.remove(temp_wav)
-                
             # res 格式通常为List[Dict]
             if res and isinstance(res, list):
                 text = res[0].get("text", "")
@@ -86,6 +136,40 @@ class SpeechHandler:
         communicate = edge_tts.Communicate(text, self.tts_voice)
         await communicate.save(output_file)
 
+    async def _synthesize_async(self, text: str) -> bytes:
+        """异步 TTS 合成，直接在内存中收集 MP3 数据"""
+        communicate = edge_tts.Communicate(text, self.tts_voice)
+        chunks = []
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                chunks.append(chunk["data"])
+        return b"".join(chunks)
+
+    def speak(self, text: str) -> bool:
+        """
+        合成并播放语音（不经过临时文件）
+        Args:
+            text: 要朗读的文本
+        Returns:
+            是否播放成功
+        """
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._synthesize_async(text), self._loop)
+            mp3_data = future.result()
+        except Exception as e:
+            print(f"[!] TTS 生成错误: {e}")
+            return False
+        if not mp3_data:
+            return False
+        
+        try:
+            audio = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3")
+        except Exception as e:
+            print(f"[!] 播放音频失败: {e}")
+            print("提示: 请确保已安装 ffmpeg (conda install ffmpeg)")
+            return False
+        return self._play_segment(audio)
+
     def text_to_speech(self, text: str, output_file: str = "response.mp3"):
         """
         文本转语音
@@ -94,7 +178,8 @@ class SpeechHandler:
             output_file: 输出文件名
         """
         try:
-            asyncio.run(self._text_to_speech_async(text, output_file))
+            future = asyncio.run_coroutine_threadsafe(self._text_to_speech_async(text, output_file), self._loop)
+            future.result()
             return output_file
         except Exception as e:
             print(f"[!] TTS 生成错误: {e}")
@@ -118,23 +203,32 @@ class SpeechHandler:
                 print(f"[!] 不支持的音频格式: {file_path}")
                 return
                 
-            # 播放 (使用 simpleaudio 或 pyaudio)
+            self._play_segment(audio)
+            
+        except Exception as e:
+            print(f"[!] 播放音频失败: {e}")
+            print("提示: 请确保已安装 ffmpeg (conda install ffmpeg)")
+
+    def _play_segment(self, audio: AudioSegment) -> bool:
+        """通过 pyaudio 播放已解码的音频"""
+        try:
             # 这里我们手动通过 pyaudio 播放以获得更好的控制
             import pyaudio
             
-            p = pyaudio.PyAudio()
-            
-            # 转换为 raw data
-            # 确保是 16bit, 16k/24k/44.1k
-            # 统一转换为 16k mono 以便统一处理? 不，播放可以随意
+            if self._pa is None:
+                self._pa = pyaudio.PyAudio()
+            p = self._pa
             
+            # 每次写入约100ms的音频，减少Python与PortAudio之间的往返次数
+            frames_per_chunk = max(1, audio.frame_rate // 10)
             stream = p.open(format=p.get_format_from_width(audio.sample_width),
                             channels=audio.channels,
                             rate=audio.frame_rate,
-                            output=True)
+                            output=True,
+                            frames_per_buffer=frames_per_chunk)
             
             # 分块播放
-            chunk_length = 1024
+            chunk_length = frames_per_chunk * audio.sample_width * audio.channels
             raw_data = audio.raw_data
             
             for i in range(0, len(raw_data), chunk_length):
@@ -142,11 +236,11 @@ class SpeechHandler:
                 
             stream.stop_stream()
             stream.close()
-            p.terminate()
+            return True
             
         except Exception as e:
             print(f"[!] 播放音频失败: {e}")
-            print("提示: 请确保已安装 ffmpeg (conda install ffmpeg)")
+            return False
 
 if __name__ == "__main__":
     # 测试代码
@@ -2,11 +2,14 @@
 无唤醒词智能语音助手主程序
 集成语音识别、意图理解、语音合成和设备控制
 """
+import os
 import sys
 import time
+import logging
 import traceback
 import threading
 import queue
+import signal
 from audio_interface import AudioInterface
 from speech_handler import SpeechHandler
 from model_handler import ModelHandler
@@ -15,8 +18,20 @@ from conversation_manager import ConversationManager
 from device_state import DeviceState
 from context_manager import ContextManager
 
-# 全局队列，用于存储捕获的音频片段
+# 流水线各级之间的队列：音频片段 -> 识别文本 -> 待播报的回复
+# 识别、意图理解、播报分别在不同线程中进行，播报上一句时可以同时处理下一句
 audio_queue = queue.Queue()
+text_queue = queue.Queue()
+# 回复队列由 SIGINT 处理函数写入，使用可重入的 SimpleQueue：
+# 信号在主线程持有 queue.Queue 内部锁时到达会造成死锁
+reply_queue = queue.SimpleQueue()
+# 放入队列表示退出主循环
+_STOP = object()
+
+def _on_sigint(signum, frame):
+    """Ctrl-C：通知主循环退出；恢复默认处理，再按一次可立即中断"""
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    reply_queue.put_nowait(_STOP)
 
 def listen_worker(audio_interface):
     """
@@ -29,77 +44,36 @@ def listen_worker(audio_interface):
     except Exception as e:
         print(f"[!] 监听线程错误: {e}")
 
-def main():
-    print("=" * 60)
-    print("智能语音助手 (全双工版)")
-    print("=" * 60)
-    print("初始化系统模块...")
-
-    # 1. 初始化模块
-    try:
-        # 语音接口
-        audio = AudioInterface(energy_threshold=30, silence_limit=1.0)
-        
-        # 语音处理 (STT/TTS)
-        speech = SpeechHandler()
-        
-        # 对话管理
-        conversation_manager = ConversationManager(max_history=10)
-        
-        # 设备状态
-        device_state = DeviceState()
-        
-        # 上下文管理
-        context_manager = ContextManager(conversation_manager, device_state)
+def asr_worker(speech):
+    """
+    识别线程工作函数：将队列中的音频转为文字
+    """
+    while True:
+        audio_data = audio_queue.get()
         
-        # 模型处理 (LLM)
-        model = ModelHandler(model_name="qwen2.5:7b")
+        # 1. 语音转文字
+        print(">>> 正在识别...")
+        text = speech.speech_to_text(audio_data)
         
-        # MQTT 客户端
-        mqtt = MQTTClient()
-        mqtt_available = mqtt.connect()
-        if not mqtt_available:
-            print("⚠ MQTT 连接失败，将无法控制设备")
+        if not text or len(text.strip()) == 0:
+            print("--- (未识别到有效语音)")
+            continue
             
-    except Exception as e:
-        print(f"系统初始化失败: {e}")
-        traceback.print_exc()
-        return
+        print(f"用户说: {text}")
+        text_queue.put(text)
 
-    print("\n✓ 系统初始化完成")
-    print("正在启动监听... (请说话)")
-    print("-" * 60)
-
-    # 启动音频流
-    audio.start_stream()
-    
-    # 启动监听线程
-    listener_thread = threading.Thread(target=listen_worker, args=(audio,), daemon=True)
-    listener_thread.start()
-    
+def nlu_worker(model, mqtt, mqtt_available, conversation_manager, context_manager, device_state):
+    """
+    理解线程工作函数：意图分析、执行指令，并把需要播报的回复放入队列
+    （对话历史和设备状态只在本线程中读写）
+    """
     # 活跃状态管理
     last_interaction_time = 0
     ACTIVE_WINDOW = 30 # 30秒内处于活跃状态，更容易触发
     
     try:
-        # 主循环：处理队列中的音频
         while True:
-            # 从队列获取音频数据（阻塞等待）
-            try:
-                # 设置超时，以便能够响应KeyboardInterrupt
-                audio_data = audio_queue.get(timeout=1.0)
-            except queue.Empty:
-                continue
-                
-            # 1. 语音转文字
-            print(">>> 正在识别...")
-            text = speech.speech_to_text(audio_data)
-            
-            if not text or len(text.strip()) == 0:
-                print("--- (未识别到有效语音)")
-                continue
-                
-            print(f"用户说: {text}")
+            text = text_queue.get()
             
             # 2. 上下文增强与意图分析
             # 处理代词
@@ -118,8 +92,16 @@ def main():
                 print("[*] 处于活跃交互模式")
             
             print(">>> 分析意图(含纠错)...")
-            # 使用解析后的文本进行意图分析
-            analysis = model.analyze_intent(resolved_text, context)
+            states = device_state.get_state_summary()
+            uncorrected_text = resolved_text
+            # 一次模型调用同时得到纠错文本、意图和指令
+            analysis = model.route(resolved_text, context, states)
+            cmd_future = None
+            if analysis is None:
+                # 回退：意图分析的同时，用未纠错的文本提前发起指令识别，两次模型调用并行进行
+                # （Ollama 需设置 OLLAMA_NUM_PARALLEL>1 才会真正并行处理）
+                cmd_future = model.recognize_command_async(resolved_text, context, states)
+                analysis = model.analyze_intent(resolved_text, context)
             intent = analysis.get("intent", "ignore")
             corrected_text = analysis.get("corrected_text", resolved_text)
             
@@ -148,29 +130,48 @@ def main():
             if intent == "command":
                 # 处理指令
                 print(">>> 识别指令详情...")
-                # 结合设备状态
-                states = device_state.get_state_summary()
-                # 使用解析后的文本
-                cmd_result = model.recognize_command(resolved_text, context, states)
+                if cmd_future is None:
+                    # 路由结果已包含指令
+                    cmd_result = analysis
+                elif resolved_text == uncorrected_text:
+                    # 文本未被纠错，直接使用提前发起的识别结果
+                    cmd_result = cmd_future.result()
+                else:
+                    # 文本被纠错，提前识别的结果作废，用纠错后的文本重新识别
+                    cmd_future.cancel()
+                    cmd_result = model.recognize_command(resolved_text, context, states)
                 
-                if cmd_result.get("type") != "none":
-                    formatted_cmd = model.format_command_message(cmd_result)
+                commands = cmd_result.get("commands") or []
+                if commands:
+                    formatted_cmds = [model.format_command_message(cmd) for cmd in commands]
+                    formatted_cmd = "，".join(formatted_cmds)
                     print(f"执行指令: {formatted_cmd}")
                     
                     if mqtt_available:
-                        success = mqtt.send_command(cmd_result)
-                        if success:
-                            device_state.update_state(cmd_result)
+                        failed = []
+                        results = mqtt.send_commands(commands)
+                        for cmd, formatted, ok in zip(commands, formatted_cmds, results):
+                            if ok:
+                                device_state.update_state(cmd)
+                            else:
+                                failed.append(formatted)
+                        if not failed:
                             response_text = f"好的，{formatted_cmd}"
                         else:
-                            response_text = f"抱歉，{formatted_cmd}失败了"
+                            response_text = f"抱歉，{'，'.join(failed)}失败了"
                     else:
                         response_text = f"我明白了，{formatted_cmd}，但是MQTT未连接。"
                     
                     should_reply = True
                     # 记录指令到历史
                     conversation_manager.add_message("user", resolved_text)
-                    conversation_manager.add_message("assistant", response_text, cmd_result)
+                    conversation_manager.add_message("assistant", response_text, {"commands": commands})
+                elif cmd_result.get("potential") and cmd_result["potential"][0].get("suggestion"):
+                    # 只有潜在意图：播报建议
+                    response_text = cmd_result["potential"][0]["suggestion"]
+                    should_reply = True
+                    conversation_manager.add_message("user", resolved_text)
+                    conversation_manager.add_message("assistant", response_text)
                 else:
                     response_text = "抱歉，我没听懂具体的指令。"
                     should_reply = True
@@ -179,33 +180,96 @@ def main():
                 # 处理闲聊
                 print(">>> 生成回复...")
                 conversation_manager.add_message("user", resolved_text)
-                response_text = model.generate_chat_response(resolved_text, context)
+                response_text = analysis.get("chat_reply") or model.generate_chat_response(resolved_text, context)
                 conversation_manager.add_message("assistant", response_text)
                 print(f"助手说: {response_text}")
                 should_reply = True
 
-            # 4. 语音回复
+            # 4. 交给播报线程（更新活跃时间）
             if should_reply and response_text:
-                # 更新活跃时间
                 last_interaction_time = time.time()
-                
-                print(f">>> 正在播报: {response_text}")
-                
-                # 暂停监听（防止听到自己）
-                audio.pause()
-                
-                tts_file = speech.text_to_speech(response_text)
-                if tts_file:
-                    speech.play_audio_file(tts_file)
-                    try:
-                        import os
-                        os.remove(tts_file)
-                    except:
-                        pass
-                
-                # 恢复监听
-                audio.resume()
-                print(">>> 恢复监听")
+                reply_queue.put(response_text)
+    except Exception as e:
+        print(f"发生错误: {e}")
+        traceback.print_exc()
+        reply_queue.put(_STOP)
+
+def main():
+    print("=" * 60)
+    print("智能语音助手 (全双工版)")
+    print("=" * 60)
+    print("初始化系统模块...")
+
+    # 1. 初始化模块
+    try:
+        # 语音接口
+        audio = AudioInterface(energy_threshold=30, silence_limit=1.0)
+        
+        # 语音处理 (STT/TTS)
+        speech = SpeechHandler()
+        
+        # 对话管理
+        conversation_manager = ConversationManager(max_history=10)
+        
+        # 设备状态
+        device_state = DeviceState()
+        
+        # 上下文管理
+        context_manager = ContextManager(conversation_manager, device_state)
+        
+        # 模型处理 (LLM)
+        model = ModelHandler(model_name="qwen2.5:7b")
+        # 预加载模型，并定期刷新，避免空闲时被Ollama卸载
+        print("正在加载语言模型...")
+        model.warmup(refresh_interval=20 * 60)
+        
+        # MQTT 客户端
+        mqtt = MQTTClient()
+        mqtt_available = mqtt.connect()
+        if not mqtt_available:
+            print("⚠ MQTT 连接失败，将无法控制设备")
+            
+    except Exception as e:
+        print(f"系统初始化失败: {e}")
+        traceback.print_exc()
+        return
+
+    print("\n✓ 系统初始化完成")
+    print("正在启动监听... (请说话)")
+    print("-" * 60)
+
+    # 启动音频流
+    audio.start_stream()
+    
+    # 启动监听、识别、理解线程
+    for target, args in ((listen_worker, (audio,)),
+                         (asr_worker, (speech,)),
+                         (nlu_worker, (model, mqtt, mqtt_available, conversation_manager, context_manager, device_state))):
+        threading.Thread(target=target, args=args, daemon=True).start()
+    
+    # Ctrl-C 通过队列唤醒主循环，主循环可以无超时地阻塞等待
+    signal.signal(signal.SIGINT, _on_sigint)
+    
+    try:
+        # 主循环：播报回复
+        while True:
+            # 从队列获取回复（阻塞等待）
+            response_text = reply_queue.get()
+            if response_text is _STOP:
+                print("\n停止监听")
+                break
+            
+            print(f">>> 正在播报: {response_text}")
+            
+            # 只在播放期间暂停监听（防止听到自己）
+            audio.pause()
+            
+            # 合成后直接在内存中解码播放，不写临时文件
+            speech.speak(response_text)
+            
+            # 恢复监听
+            audio.resume()
+            print(">>> 恢复监听")
 
 
     except KeyboardInterrupt:
@@ -219,4 +283,5 @@ def main():
             mqtt.disconnect()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format="%(message)s")
     main()